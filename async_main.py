@@ -0,0 +1,189 @@
+"""asyncio deployment mode: the same bot and routes as main.py on an ASGI server.
+
+Run with ``uvicorn async_main:app --host 0.0.0.0 --port 5000``. The handlers
+come from handlers.py, so behaviour matches the Flask mode.
+"""
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+import certifi
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.server_api import ServerApi
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+
+from config import (BOT_TOKEN, MONGO_URI, WEBHOOK_URL, INGEST_QUEUE_SIZE, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE,
+                    ASYNC_INGEST_WORKERS, ASYNC_HTTP_CONNECTIONS, WEB_CONCURRENCY, SHARED_STORE, TELEGRAM_SHARED_RATE, APP_SETUP_DONE,
+                    TELEGRAM_API_URL, PROFILER, PROFILER_INTERVAL)
+from ingest import UpdateIngestor
+from outbound import OutboundDispatcher, SharedBudget
+from indexes import ensure_indexes, check_query_plans
+from store import make_store
+from webhook import WEBHOOK_CLAIM
+from metrics import REGISTRY, HANDLER_SECONDS, CONTENT_TYPE, MongoCommandTimer, SamplingProfiler, count_logged_errors
+from handlers import Handlers, AsyncIO
+
+# All bot calls share telebot's single keep-alive aiohttp session; this caps its connection pool.
+asyncio_helper.REQUEST_LIMIT = ASYNC_HTTP_CONNECTIONS
+asyncio_helper.API_URL = TELEGRAM_API_URL
+
+count_logged_errors()
+
+client = AsyncIOMotorClient(MONGO_URI, server_api=ServerApi('1'), tlsCAFile=certifi.where(),
+                            event_listeners=[MongoCommandTimer()])
+db = client["media_shortener"]
+
+bot = AsyncTeleBot(BOT_TOKEN)
+
+shared_store = make_store(SHARED_STORE, db.delegate)
+
+shared_rate = SharedBudget(shared_store, TELEGRAM_GLOBAL_RATE) if TELEGRAM_SHARED_RATE else None
+outbound = OutboundDispatcher(global_rate=TELEGRAM_GLOBAL_RATE if shared_rate else TELEGRAM_GLOBAL_RATE / WEB_CONCURRENCY,
+                              chat_rate=TELEGRAM_CHAT_RATE, shared=shared_rate)
+io = AsyncIO(outbound)
+# The thread-based jobs reach MongoDB through Motor's underlying pymongo objects.
+handlers = Handlers(bot, io, db, db.delegate, shared_store)
+handlers.register()
+
+ingestor = UpdateIngestor(lambda update: io.from_thread(bot.process_new_updates, [update]),
+                          workers=ASYNC_INGEST_WORKERS, max_queue=INGEST_QUEUE_SIZE, put_timeout=0,
+                          store=shared_store if SHARED_STORE == "mongo" else None)
+
+REGISTRY.gauge("bot_pending_deletions", "Messages waiting for scheduled deletion.",
+               lambda: handlers.deletion_scheduler.stats()["pending"])
+REGISTRY.gauge("bot_ingest_queue_depth", "Updates queued for the handlers.", lambda: ingestor.depth())
+REGISTRY.gauge("bot_live_tokens", "Verification tokens cached in memory.", lambda: handlers.live_tokens.stats()["size"])
+profiler = SamplingProfiler(interval=PROFILER_INTERVAL)
+if PROFILER:
+    profiler.start()
+
+
+def page_response(result):
+    status, body, headers = result
+    return Response(body, status, headers=headers)
+
+
+def remote_addr(request):
+    return request.client.host if request.client else None
+
+
+@HANDLER_SECONDS.time("receive_updates")
+async def receive_updates(request: Request):
+    try:
+        update = types.Update.de_json((await request.body()).decode())
+        if not await handlers.update_allowed(update):
+            return Response(status_code=200)
+        if not await asyncio.to_thread(ingestor.submit, update):
+            return Response(status_code=503)
+    except Exception as e:
+        logging.error(f"Failed to process update: {e}")
+    return Response(status_code=200)
+
+
+@HANDLER_SECONDS.time("verify")
+async def verify(request: Request):
+    return page_response(handlers.page("verify.html", request.path_params["unique_id"], request.headers))
+
+
+@HANDLER_SECONDS.time("verify_continue")
+async def verify_continue(request: Request):
+    return page_response(handlers.page("verify_continue.html", request.path_params["unique_id"], request.headers))
+
+
+@HANDLER_SECONDS.time("verify_final")
+async def verify_final(request: Request):
+    return page_response(await handlers.verify_final(request.path_params["unique_id"], remote_addr(request),
+                                                     request.headers))
+
+
+@HANDLER_SECONDS.time("verify_success")
+async def verify_success(request: Request):
+    status, body = await handlers.verify_success(request.path_params["unique_id"], remote_addr(request), request.headers,
+                                                 file_token=request.query_params.get("file_token"))
+    return JSONResponse(body, status)
+
+
+async def index(request: Request):
+    return Response("")
+
+
+async def stats(request: Request):
+    return JSONResponse({**handlers.stats(),
+                         "ingest": ingestor.stats(),
+                         "outbound": outbound.stats()})
+
+
+async def metrics(request: Request):
+    return Response(REGISTRY.render(), 200, media_type=CONTENT_TYPE)
+
+
+async def debug_profile(request: Request):
+    if not profiler.running:
+        return Response("", 404)
+    return Response(profiler.collapsed(reset=request.query_params.get("reset") == "1"), 200, media_type="text/plain")
+
+
+async def set_webhook(max_retries=3):
+    webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{BOT_TOKEN}"
+    for attempt in range(max_retries):
+        try:
+            await bot.set_webhook(url=webhook_url)
+            logging.info("Webhook set successfully.")
+            return True
+        except Exception as e:
+            if getattr(e, "error_code", None) != 429:
+                logging.error(f"Error while setting webhook: {e}")
+                return False
+            retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+            logging.info(f"Too many requests. Retrying after {retry_after} seconds...")
+            await asyncio.sleep(retry_after)
+    logging.error("Max retries reached. Failed to set webhook.")
+    return False
+
+
+@asynccontextmanager
+async def lifespan(app):
+    io.loop = asyncio.get_running_loop()
+    handlers.deletion_scheduler.start()
+    handlers.start_jobs()
+    if not APP_SETUP_DONE:
+        threading.Thread(target=lambda: (ensure_indexes(db.delegate), check_query_plans(db.delegate)),
+                         name="db-setup", daemon=True).start()
+    bot_metadata = handlers.bot_metadata
+    try:
+        await bot_metadata.load_async()
+    except Exception as e:
+        logging.error(f"Failed to load bot metadata: {e}")
+    refresher = asyncio.create_task(bot_metadata.run_async(
+        initial_delay=bot_metadata.refresh_interval if bot_metadata.loaded_at else bot_metadata.retry_interval))
+    if not APP_SETUP_DONE and await asyncio.to_thread(shared_store.add_if_absent, WEBHOOK_CLAIM, 300):
+        logging.info("Setting up webhook...")
+        if not await set_webhook():
+            # Release the claim so the next worker to start tries again.
+            await asyncio.to_thread(shared_store.discard, WEBHOOK_CLAIM)
+    yield
+    refresher.cancel()
+    await bot.close_session()
+
+
+app = Starlette(routes=[
+    Route(f"/{BOT_TOKEN}", receive_updates, methods=["POST"]),
+    Route("/verify/{unique_id}", verify, methods=["GET"]),
+    Route("/verify_continue/{unique_id}", verify_continue, methods=["GET"]),
+    Route("/verify_final/{unique_id}", verify_final, methods=["GET"]),
+    Route("/verify_success/{unique_id}", verify_success, methods=["POST"]),
+    Route("/", index, methods=["GET"]),
+    Route("/stats", stats, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+    Route("/debug/profile", debug_profile, methods=["GET"]),
+], lifespan=lifespan)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5000)
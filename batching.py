@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import core
+from ids import allocate_link_ids, new_link_id
+
+
+class UploadBatcher:
+    """Collects uploads that belong together (a media group, or files posted within a window).
+
+    A batch is flushed ``window`` seconds after its last item, or as soon as it
+    reaches ``max_items``. All batches due at the same moment are handed to
+    ``flush`` together so they can be written in one round trip.
+    """
+
+    def __init__(self, flush, window=2.0, max_items=50):
+        self.flush = flush
+        self.window = window
+        self.max_items = max_items
+        self._batches = {}
+        self._cond = threading.Condition()
+        self.flushed_batches = 0
+        self.flushed_items = 0
+        threading.Thread(target=self._run, name="upload-batcher", daemon=True).start()
+
+    def add(self, key, item):
+        with self._cond:
+            batch = self._batches.setdefault(key, [0.0, []])
+            batch[1].append(item)
+            batch[0] = 0.0 if len(batch[1]) >= self.max_items else time.monotonic() + self.window
+            self._cond.notify()
+
+    def _due(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due = [key for key, (deadline, _) in self._batches.items() if deadline <= now]
+                if due:
+                    return [self._batches.pop(key)[1] for key in due]
+                deadlines = [deadline for deadline, _ in self._batches.values()]
+                self._cond.wait(min(deadlines) - now if deadlines else None)
+
+    def _run(self):
+        while True:
+            batches = self._due()
+            try:
+                self.flush(batches)
+                self.flushed_batches += len(batches)
+                self.flushed_items += sum(len(batch) for batch in batches)
+            except Exception as e:
+                logging.error(f"Failed to flush {len(batches)} upload batches: {e}")
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._batches)
+        return {"pending_batches": pending, "flushed_batches": self.flushed_batches, "flushed_items": self.flushed_items}
+
+
+def store_batches(collection, batches):
+    """Write flushed batches with one bulk_write.
+
+    Returns, per batch, the new link id, ``None`` when the batch only extended
+    an album another flush already created, or ``False`` when it was not saved.
+    """
+    link_ids = allocate_link_ids(len(batches))
+    operations = [core.batch_upsert(link_id, messages) for link_id, messages in zip(link_ids, batches)]
+    results = [None] * len(batches)
+    failed = {}
+    try:
+        upserted = collection.bulk_write([UpdateOne(f, u, upsert=True) for f, u in operations], ordered=False).upserted_ids
+    except BulkWriteError as e:
+        upserted = {op["index"]: op["_id"] for op in e.details.get("upserted", [])}
+        failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+    except Exception as e:
+        logging.error(f"Failed to save {len(batches)} file batches: {e}")
+        return [False] * len(batches)
+    for index in upserted:
+        results[index] = link_ids[index]
+    for index, error in failed.items():
+        results[index] = False
+        if error.get("code") != 11000:
+            logging.error(f"Failed to save file batch: {error.get('errmsg')}")
+            continue
+        # Either the link id collided or a concurrent flush just created the album; retry once.
+        link_id = new_link_id()
+        try:
+            result = collection.update_one(*core.batch_upsert(link_id, batches[index]), upsert=True)
+            results[index] = link_id if result.upserted_id is not None else None
+        except Exception as retry_error:
+            logging.error(f"Failed to save file batch: {retry_error}")
+    return results
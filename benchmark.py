@@ -0,0 +1,381 @@
+"""Offline load test for the Flask mode.
+
+Runs main.py against a local fake Bot API server and mongomock (or a local
+mongod with --mongo-uri), replays scripted webhook and verification traffic
+at a fixed rate, and writes per-route p50/p95/p99 latency and throughput as
+JSON so runs can be compared across commits:
+
+    python benchmark.py --rate 200 --count 2000 --output bench.json
+
+With --serve the app runs as deployed, under ``gunicorn -c gunicorn.conf.py``,
+and is sent real HTTP requests over keep-alive connections. Several workers
+(--workers) must share a database, so they need --mongo-uri:
+
+    python benchmark.py --serve --workers 4 --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import json
+import math
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+BOT_TOKEN = "123456:bench"
+OWNER_ID = 1
+ADMIN_ID = 2
+GROUP_ID = -100200
+CHANNEL_ID = -100100
+FIRST_USER = 10000000
+# Deep links in the bot's replies: file links to uploads, verification links to /start.
+FILE_LINK = re.compile(r"\?start=([A-Za-z0-9_-]+)")
+VERIFY_LINK = re.compile(r"/verify/([A-Za-z0-9_-]+)")
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """Answers Bot API methods with canned results after ``latency`` seconds and counts calls per method.
+
+    The distinct file and verification tokens found in sent messages are
+    collected in ``file_links`` and ``verify_links``, in the order they were sent.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(("127.0.0.1", 0), _FakeBotAPIHandler)
+        self.latency = latency
+        self.calls = {}
+        self.file_links = {}
+        self.verify_links = {}
+        self._message_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/bot{{0}}/{{1}}"
+
+    def result(self, method, params):
+        sent = " ".join(str(value) for value in params.values())
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self._message_id += 1
+            message_id = self._message_id
+            self.file_links.update(dict.fromkeys(FILE_LINK.findall(sent)))
+            self.verify_links.update(dict.fromkeys(VERIFY_LINK.findall(sent)))
+        if method == "getMe":
+            return {"id": 999, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getChat":
+            return {"id": int(params.get("chat_id", CHANNEL_ID)), "type": "channel", "title": "Bench",
+                    "username": "bench_channel"}
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params.get("user_id", 0)), "is_bot": False, "first_name": "U"}}
+        if method.startswith("send") or method.startswith("edit"):
+            message = {"message_id": message_id, "date": int(time.time()),
+                       "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}}
+            return [message] if method == "sendMediaGroup" else message
+        return True
+
+
+class _FakeBotAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        payload = json.dumps({"ok": True, "result": self.server.result(url.path.rsplit("/", 1)[-1], params)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+def message_update(update_id, chat_id, user_id, text=None, document=None):
+    message = {"message_id": update_id, "date": int(time.time()),
+               "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+               "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if document is not None:
+        message["document"] = {"file_id": document, "file_unique_id": document, "file_name": f"{document}.bin"}
+    return {"update_id": update_id, "message": message}
+
+
+def percentile(samples, p):
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] if samples else None
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.statuses = {}
+        self.started = {}
+        self.finished = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, started, latency, status):
+        with self._lock:
+            self.samples.setdefault(route, []).append(latency)
+            self.errors[route] = self.errors.get(route, 0) + (status >= 400)
+            statuses = self.statuses.setdefault(route, {})
+            statuses[status] = statuses.get(status, 0) + 1
+            self.started[route] = min(self.started.get(route, started), started)
+            self.finished[route] = max(self.finished.get(route, 0), started + latency)
+
+    def accepted(self, route):
+        with self._lock:
+            return len(self.samples.get(route, [])) - self.errors.get(route, 0)
+
+    def report(self):
+        routes = {}
+        for route, samples in self.samples.items():
+            samples = sorted(samples)
+            elapsed = self.finished[route] - self.started[route]
+            routes[route] = {"count": len(samples), "errors": self.errors[route], "statuses": self.statuses[route],
+                             "p50_ms": round(percentile(samples, 50) * 1000, 3),
+                             "p95_ms": round(percentile(samples, 95) * 1000, 3),
+                             "p99_ms": round(percentile(samples, 99) * 1000, 3),
+                             "max_ms": round(samples[-1] * 1000, 3),
+                             "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else None}
+        return routes
+
+
+class HTTPClient:
+    """The part of Flask's test client ``replay`` uses, sending real HTTP on one keep-alive session."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def open(self, path, method="GET", **kwargs):
+        return self.session.request(method, self.base_url + path, **kwargs)
+
+
+def mongomock_app():
+    """``--serve`` app factory without ``--mongo-uri``: main.py on an in-process mongomock."""
+    import mongomock
+    import pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+    import main
+    return main.create_app()
+
+
+class Gunicorn:
+    """Runs the app under ``gunicorn -c gunicorn.conf.py`` on a free local port until ``stop``."""
+
+    def __init__(self, workers, mongo_uri=None):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.log = tempfile.TemporaryFile()
+        env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers))
+        app = "main:create_app()" if mongo_uri else "benchmark:mongomock_app()"
+        self.process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", app],
+                                        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self.process.poll() is None:
+            try:
+                stats = requests.get(self.base_url + "/stats", timeout=1).json()
+                if stats["startup"]["ready"]:
+                    return stats["startup"]
+            except (requests.RequestException, ValueError, KeyError):
+                pass
+            time.sleep(0.2)
+        self.stop()
+        self.log.seek(0)
+        raise RuntimeError("gunicorn did not start:\n" + self.log.read().decode(errors="replace")[-4000:])
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+def replay(client_factory, jobs, rate, concurrency, recorder):
+    """Start each job at its slot of a fixed ``rate`` schedule (open loop) on ``concurrency`` threads."""
+    local = threading.local()
+
+    def call(route, method, path, **kwargs):
+        if not hasattr(local, "client"):
+            local.client = client_factory()
+        started = time.perf_counter()
+        response = local.client.open(path, method=method, **kwargs)
+        recorder.record(route, started, time.perf_counter() - started, response.status_code)
+        return response
+
+    def run(slot, job):
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        job(call)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(run, start + i / rate, job) for i, job in enumerate(jobs)]:
+            future.result()
+
+
+def webhook_job(route, update):
+    return lambda call: call(route, "POST", f"/{BOT_TOKEN}", json=update)
+
+
+def verify_job(unique_id):
+    def job(call):
+        call("GET /verify", "GET", f"/verify/{unique_id}", headers={"Accept-Encoding": "gzip"})
+        call("GET /verify_continue", "GET", f"/verify_continue/{unique_id}", headers={"Accept-Encoding": "gzip"})
+        call("GET /verify_final", "GET", f"/verify_final/{unique_id}", headers={"Accept-Encoding": "gzip"})
+        call("POST /verify_success", "POST", f"/verify_success/{unique_id}")
+    return job
+
+
+def wait_until(predicate, what, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError(f"timed out waiting for {what}")
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=200, help="requests started per second in each phase")
+    parser.add_argument("--count", type=int, default=1000, help="updates per phase")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds the fake Bot API waits per call")
+    parser.add_argument("--mongo-uri", help="use this MongoDB (e.g. a local mongod) instead of mongomock")
+    parser.add_argument("--serve", action="store_true", help="run under gunicorn and send real HTTP requests")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers with --serve (more than one needs --mongo-uri)")
+    parser.add_argument("--output", default="bench.json")
+    args = parser.parse_args()
+    if args.serve and args.workers > 1 and not args.mongo_uri:
+        parser.error("--workers above 1 needs --mongo-uri: each worker would have its own mongomock")
+
+    fake = FakeBotAPI(latency=args.telegram_latency)
+    threading.Thread(target=fake.serve_forever, name="fake-bot-api", daemon=True).start()
+    # The gunicorn master connects with the real driver even on mongomock; fail fast there.
+    os.environ.update({"BOT_TOKEN": BOT_TOKEN, "MONGO_URI": args.mongo_uri or "mongodb://localhost/?serverSelectionTimeoutMS=1000",
+                       "WEBHOOK_URL": "http://localhost", "WEBHOOK_URL2": "http://localhost",
+                       "CHANNEL_ID": str(CHANNEL_ID), "OWNER_ID": str(OWNER_ID),
+                       "PRIVATE_GROUP_ID": str(GROUP_ID), "ADMINS": str(ADMIN_ID),
+                       "TELEGRAM_API_URL": fake.api_url})
+    # Measure the bot, not Telegram's flood limits or the abuse limits (every request comes
+    # from one address), unless the caller sets them.
+    os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("TELEGRAM_CHAT_RATE", "1000000")
+    os.environ.setdefault("IP_RATE_LIMIT", "1000000000")
+    os.environ.setdefault("ROUTE_RATE_LIMIT", "1000000000")
+    if args.mongo_uri:
+        import pymongo
+        database = pymongo.MongoClient(args.mongo_uri)["media_shortener"]
+        database["users"].drop()
+        database["file_storage"].drop()
+
+    server = bot_main = None
+    if args.serve:
+        server = Gunicorn(args.workers, args.mongo_uri)
+        startup = server.wait_ready()
+        client_factory = lambda: HTTPClient(server.base_url)
+    else:
+        if not args.mongo_uri:
+            import mongomock
+            import pymongo
+            pymongo.MongoClient = mongomock.MongoClient
+        import main as bot_main
+        startup = None
+        client_factory = bot_main.app.test_client
+    recorder = Recorder()
+    n = args.count
+    update_ids = iter(range(1, 10 * n + 1))
+
+    try:
+        uploads = [webhook_job("POST /webhook (upload)", message_update(next(update_ids), GROUP_ID, ADMIN_ID, document=f"file{i}"))
+                   for i in range(n)]
+        replay(client_factory, uploads, args.rate, args.concurrency, recorder)
+        # Each accepted upload is answered with its link (a full ingest queue answers 503 instead).
+        wait_until(lambda: len(fake.file_links) >= recorder.accepted("POST /webhook (upload)"), "the upload links")
+
+        file_token = next(iter(fake.file_links))
+        starts = [webhook_job("POST /webhook (/start)", message_update(next(update_ids), FIRST_USER + i, FIRST_USER + i, "/start"))
+                  for i in range(n)]
+        replay(client_factory, starts, args.rate, args.concurrency, recorder)
+        # Fresh users, so each /start <token> creates a pending subscription for the verify phase.
+        token_starts = [webhook_job("POST /webhook (/start <token>)",
+                                    message_update(next(update_ids), FIRST_USER + n + i, FIRST_USER + n + i, f"/start {file_token}"))
+                        for i in range(n)]
+        replay(client_factory, token_starts, args.rate, args.concurrency, recorder)
+        started = recorder.accepted("POST /webhook (/start)")
+        with_file = recorder.accepted("POST /webhook (/start <token>)")
+        wait_until(lambda: len(fake.verify_links) >= started + with_file, "the subscription messages")
+        assert len(fake.verify_links) == started + with_file, \
+            f"expected {started + with_file} pending subscriptions, found {len(fake.verify_links)}"
+        # Subscription records are written behind; every /start above must be in MongoDB before it is verified.
+        if bot_main:
+            bot_main.handlers.subscription_writes.flush()
+        elif args.mongo_uri:
+            wait_until(lambda: database["users"].count_documents({"verified": False}) >= started + with_file,
+                       "the subscription records")
+        else:
+            def written():
+                writes = client_factory().open("/stats").json()["subscription_writes"]
+                return writes["flushed"] + writes["failed"] >= writes["buffered"]
+            wait_until(written, "the subscription records")
+
+        replay(client_factory, [verify_job(unique_id) for unique_id in list(fake.verify_links)], args.rate, args.concurrency,
+               recorder)
+        # Each verified /start <token> delivers the file stored with the subscription, and only once.
+        delivered = with_file - recorder.errors.get("POST /verify_success", 0)
+        wait_until(lambda: fake.calls.get("sendDocument", 0) >= delivered, "the file deliveries")
+        time.sleep(0.5)
+        assert delivered <= fake.calls["sendDocument"] <= with_file, "verification did not deliver every pending file once"
+        response = client_factory().open("/stats")
+        app_stats = response.get_json() if bot_main else response.json()
+    finally:
+        if server:
+            server.stop()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    result = {"commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "settings": {"rate": args.rate, "count": n, "concurrency": args.concurrency,
+                           "telegram_latency": args.telegram_latency, "mongo": "mongod" if args.mongo_uri else "mongomock",
+                           "server": f"gunicorn ({args.workers} workers)" if args.serve else "flask test client",
+                           "cpus": os.cpu_count()},
+              "startup": startup, "routes": recorder.report(), "telegram_calls": fake.calls, "app_stats": app_stats}
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, default=str)
+    for route, numbers in result["routes"].items():
+        print(f"{route:32} n={numbers['count']:6} err={numbers['errors']:4} p50={numbers['p50_ms']:8.2f}ms "
+              f"p95={numbers['p95_ms']:8.2f}ms p99={numbers['p99_ms']:8.2f}ms {numbers['throughput_rps']} req/s")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
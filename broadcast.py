@@ -0,0 +1,238 @@
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+import core
+
+
+class Broadcaster:
+    """Sends one message to every user, resumable from a checkpoint in MongoDB.
+
+    chat_ids are streamed from a batched cursor over ``users`` in _id order
+    and copied by a pool of ``workers`` threads through ``send``, which
+    should go through the OutboundDispatcher at BACKGROUND priority so the
+    bot keeps answering users. After each batch the last _id and the
+    counters are saved to ``broadcasts``; a run interrupted by a restart is
+    picked up again with ``resume`` and sends at most one batch twice.
+    Users whose chat is blocked or deactivated are flagged ``blocked`` and
+    skipped by later broadcasts.
+
+    A running job records its ``owner`` process and a heartbeat; it can be
+    resumed as soon as that process is gone (a dead pid on this host, or no
+    heartbeat for ``stale_after`` seconds).
+    """
+
+    def __init__(self, users, broadcasts, send, workers=8, batch_size=200, report_interval=15, stale_after=30):
+        self.users = users
+        self.broadcasts = broadcasts
+        self.send = send
+        self.workers = workers
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+        self.stale_after = stale_after
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.job = None
+        self._run_started = None
+        self._run_processed = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, from_chat_id, message_id, report=None):
+        """Start broadcasting a copy of ``message_id``; returns the job, or None while another run is live."""
+        with self._lock:
+            if self.running or self._live_elsewhere():
+                return None
+            now = datetime.utcnow()
+            job = {"from_chat_id": from_chat_id, "message_id": message_id, "state": "running", "owner": self.owner,
+                   "last_id": None,
+                   "total": self.users.count_documents({"blocked": {"$ne": True}}),
+                   "sent": 0, "failed": 0, "blocked": 0, "started_at": now, "updated_at": now}
+            job["_id"] = self.broadcasts.insert_one(job).inserted_id
+            self._launch(job, report)
+            return job
+
+    def resume(self, report=None):
+        """Continue the latest broadcast whose worker stopped without finishing it."""
+        with self._lock:
+            if self.running:
+                return None
+            for job in self.broadcasts.find({"state": "running"}).sort("started_at", -1):
+                if not self._orphaned(job):
+                    continue
+                # Claimed on the owner and heartbeat we saw, so two workers never resume the same job.
+                job = self.broadcasts.find_one_and_update(
+                    {"_id": job["_id"], "state": "running", "owner": job.get("owner"), "updated_at": job["updated_at"]},
+                    {"$set": {"owner": self.owner, "updated_at": datetime.utcnow()}},
+                    return_document=ReturnDocument.AFTER)
+                if job:
+                    self._launch(job, report)
+                    return job
+            return None
+
+    def cancel(self):
+        """Stop the running broadcast, on whichever worker it runs, at its next checkpoint."""
+        return self.broadcasts.update_many({"state": "running"}, {"$set": {"state": "cancelled"}}).modified_count > 0
+
+    def _live_elsewhere(self):
+        return any(not self._orphaned(job)
+                   for job in self.broadcasts.find({"state": "running"}, {"owner": 1, "updated_at": 1}))
+
+    def _orphaned(self, job):
+        """True once the process running ``job`` is gone."""
+        owner = job.get("owner")
+        if owner == self.owner:
+            return not self.running
+        if job["updated_at"] < datetime.utcnow() - timedelta(seconds=self.stale_after):
+            return True
+        host, _, pid = (owner or "").rpartition(":")
+        return host == socket.gethostname() and pid.isdigit() and not _pid_alive(int(pid))
+
+    def _launch(self, job, report):
+        self.job = job
+        self._run_started = time.monotonic()
+        self._run_processed = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(job, report), name="broadcast", daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._heartbeat, args=(job, self._stopped), name="broadcast-heartbeat", daemon=True).start()
+
+    def _heartbeat(self, job, stopped):
+        # Batches can take longer than stale_after, so liveness is refreshed between checkpoints too.
+        while not stopped.wait(self.stale_after / 3):
+            try:
+                self.broadcasts.update_one({"_id": job["_id"], "state": "running", "owner": self.owner},
+                                           {"$set": {"updated_at": datetime.utcnow()}})
+            except Exception as e:
+                logging.error(f"Broadcast {job['_id']} heartbeat failed: {e}")
+
+    def _run(self, job, report):
+        query = {"blocked": {"$ne": True}}
+        if job["last_id"] is not None:
+            query["_id"] = {"$gt": job["last_id"]}
+        cursor = self.users.find(query, {"chat_id": 1}).sort("_id", 1).batch_size(self.batch_size)
+        reported = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="broadcast-send") as pool:
+                batch = []
+                for user in cursor:
+                    batch.append(user)
+                    if len(batch) < self.batch_size:
+                        continue
+                    if not self._send_batch(pool, job, batch):
+                        return
+                    batch = []
+                    if time.monotonic() - reported >= self.report_interval:
+                        reported = time.monotonic()
+                        self._report(report)
+                if batch and not self._send_batch(pool, job, batch):
+                    return
+            self._checkpoint(job, {"state": "done"})
+            logging.info(f"Broadcast {job['_id']} done: {job['sent']} sent, {job['failed']} failed, {job['blocked']} blocked.")
+        except Exception as e:
+            logging.error(f"Broadcast {job['_id']} stopped: {e}")
+            self._checkpoint(job, {"state": "failed"})
+        finally:
+            self._stopped.set()
+            cursor.close()
+            self._report(report)
+
+    def _send_one(self, chat_id):
+        job = self.job
+        try:
+            self.send(chat_id, job["from_chat_id"], job["message_id"])
+            return "sent"
+        except Exception as e:
+            if core.is_blocked_error(e):
+                return "blocked"
+            logging.warning(f"Broadcast to {chat_id} failed: {e}")
+            return "failed"
+
+    def _send_batch(self, pool, job, batch):
+        """Send one batch and checkpoint it; returns False once the broadcast has been cancelled."""
+        chat_ids = [user["chat_id"] for user in batch]
+        results = list(pool.map(self._send_one, chat_ids))
+        blocked = [chat_id for chat_id, result in zip(chat_ids, results) if result == "blocked"]
+        if blocked:
+            self.users.update_many({"chat_id": {"$in": blocked}},
+                                   {"$set": {"blocked": True, "blocked_at": datetime.utcnow()}})
+        for result in ("sent", "failed", "blocked"):
+            job[result] += results.count(result)
+        job["last_id"] = batch[-1]["_id"]
+        self._run_processed += len(batch)
+        if not self._checkpoint(job):
+            job["state"] = "cancelled"
+            logging.info(f"Broadcast {job['_id']} cancelled after {self.processed(job)} users.")
+            return False
+        return True
+
+    def _checkpoint(self, job, fields=None):
+        fields = {"last_id": job["last_id"], "sent": job["sent"], "failed": job["failed"], "blocked": job["blocked"],
+                  "updated_at": datetime.utcnow(), **(fields or {})}
+        job.update(fields)
+        # Matching on state and owner means a cancel from any worker, or a takeover after this one
+        # looked dead, is seen at the next checkpoint.
+        return self.broadcasts.update_one({"_id": job["_id"], "state": "running", "owner": self.owner},
+                                          {"$set": fields}).matched_count > 0
+
+    def _report(self, report):
+        if report is None:
+            return
+        try:
+            report(self.progress())
+        except Exception as e:
+            logging.error(f"Failed to report broadcast progress: {e}")
+
+    @staticmethod
+    def processed(job):
+        return job["sent"] + job["failed"] + job["blocked"]
+
+    def progress(self):
+        """Progress of the run in this process, or None."""
+        job = self.job
+        if job is None:
+            return None
+        elapsed = time.monotonic() - self._run_started
+        return self._progress(job, self._run_processed / elapsed if elapsed else 0.0)
+
+    def latest(self):
+        """Progress of the latest broadcast as saved in ``broadcasts``, whichever worker runs it."""
+        job = self.broadcasts.find_one({}, sort=[("started_at", -1)])
+        if job is None:
+            return None
+        if self.running and self.job["_id"] == job["_id"]:
+            # This worker runs it; the saved state still shows a cancel from another worker.
+            return dict(self.progress(), state=job["state"])
+        elapsed = (job["updated_at"] - job["started_at"]).total_seconds()
+        return self._progress(job, self.processed(job) / elapsed if elapsed > 0 else 0.0)
+
+    def _progress(self, job, per_second):
+        per_second = round(per_second, 1)
+        processed = self.processed(job)
+        remaining = max(job["total"] - processed, 0)
+        return {"id": str(job["_id"]), "state": job["state"], "total": job["total"], "processed": processed,
+                "sent": job["sent"], "failed": job["failed"], "blocked": job["blocked"], "per_second": per_second,
+                "eta_seconds": round(remaining / per_second) if per_second and job["state"] == "running" else None}
+
+    def stats(self):
+        return self.progress() or {"state": None}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
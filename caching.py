@@ -0,0 +1,274 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL.
+
+    ``None`` values are cached as negative results with their own, usually
+    shorter, ``negative_ttl``. ``get`` returns ``MISSING`` on a miss so a
+    cached ``None`` can be told apart from an absent key.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300, negative_ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        return {"size": size, "maxsize": self.maxsize, "hits": self.hits, "negative_hits": self.negative_hits,
+                "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations}
+
+
+class LiveTokens:
+    """Verification tokens this worker issued recently, so ``/verify_final`` can skip MongoDB.
+
+    A per-worker hint only: tokens issued by another worker miss and are
+    looked up (and the answer cached) like unknown ones. Issuing a new token
+    for a chat retires the one it replaces.
+    """
+
+    def __init__(self, maxsize=100000, ttl=3600, negative_ttl=60):
+        self._tokens = TTLCache(maxsize=maxsize, ttl=ttl, negative_ttl=negative_ttl)
+        self._latest = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, token):
+        """True when live, None when known dead, or MISSING."""
+        return self._tokens.get(token)
+
+    def set(self, token, live):
+        self._tokens.set(token, live)
+
+    def issue(self, chat_id, token):
+        previous = self._latest.get(chat_id)
+        if previous is not MISSING and previous != token:
+            self._tokens.set(previous, None)
+        self._latest.set(chat_id, token)
+        self._tokens.set(token, True)
+
+    def stats(self):
+        return self._tokens.stats()
+
+
+class SubscriptionCache:
+    """Per-chat ``subscribed_until`` cache answering "is subscribed" without I/O.
+
+    Active subscriptions are cached until they expire; unsubscribed chats are
+    cached for ``negative_ttl`` only, because another instance may verify them.
+    ``watch`` keeps instances coherent by following a MongoDB change stream;
+    while a watched stream is down, unsubscribed chats are not cached at all.
+    """
+
+    def __init__(self, maxsize=100000, negative_ttl=30):
+        self._cache = TTLCache(maxsize=maxsize, negative_ttl=negative_ttl)
+        self._watcher = None
+        self._stream_live = False
+
+    def get(self, chat_id):
+        """Return True/False when known, or MISSING when the database must be asked."""
+        subscribed_until = self._cache.get(chat_id)
+        if subscribed_until is MISSING:
+            return MISSING
+        return subscribed_until is not None and datetime.utcnow() < subscribed_until
+
+    def update(self, chat_id, subscribed_until):
+        remaining = (subscribed_until - datetime.utcnow()).total_seconds() if subscribed_until else 0
+        if remaining > 0:
+            self._cache.set(chat_id, subscribed_until, ttl=remaining)
+        elif self._watcher is None or self._stream_live:
+            self._cache.set(chat_id, None)
+        else:
+            # A verification on another worker would go unseen until the stream is back.
+            self._cache.invalidate(chat_id)
+
+    def watch(self, collection):
+        if self._watcher:
+            return
+        self._watcher = threading.Thread(target=self._follow, args=(collection,), name="subscription-watcher", daemon=True)
+        self._watcher.start()
+
+    def _follow(self, collection):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+        resume_token = None
+        while True:
+            try:
+                with collection.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    self._stream_live = True
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change.get("fullDocument")
+                        if doc and "chat_id" in doc:
+                            self.update(doc["chat_id"], doc.get("subscribed_until"))
+            except Exception as e:
+                self._stream_live = False
+                logging.error(f"Subscription change stream failed, reconnecting: {e}")
+                time.sleep(5)
+
+    def stats(self):
+        return dict(self._cache.stats(), watching=self._watcher is not None, stream_live=self._stream_live)
+
+
+class MembershipCache:
+    """Channel-membership cache with coalesced lookups and stale-while-revalidate.
+
+    ``fetch(key)`` returns True/False or raises. Joined and not-joined results
+    get separate TTLs; concurrent misses for the same key share one fetch, and
+    when a fetch fails a previous answer younger than ``stale_ttl`` is served.
+    """
+
+    def __init__(self, fetch, positive_ttl=600, negative_ttl=30, stale_ttl=3600, maxsize=100000):
+        self.fetch = fetch
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_served = 0
+        self.errors = 0
+        self.refreshed = 0
+
+    def _ttl(self, joined):
+        return self.positive_ttl if joined else self.negative_ttl
+
+    def get(self, key):
+        joined = self.peek(key)
+        return self.load(key) if joined is MISSING else joined
+
+    def peek(self, key):
+        """The fresh cached answer for ``key``, or MISSING; never fetches."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                joined, fetched_at, _ = entry
+                self._entries[key] = (joined, fetched_at, time.monotonic())
+                self._entries.move_to_end(key)
+                if time.monotonic() - fetched_at < self._ttl(joined):
+                    self.hits += 1
+                    return joined
+            self.misses += 1
+        return MISSING
+
+    def load(self, key):
+        """Fetch ``key``, sharing the call with concurrent loads of the same key."""
+        with self._lock:
+            waiter = self._inflight.get(key)
+            owner = waiter is None
+            if owner:
+                waiter = self._inflight[key] = [threading.Event(), None]
+            else:
+                self.coalesced += 1
+        if not owner:
+            waiter[0].wait()
+            return waiter[1]
+        try:
+            joined = self.fetch(key)
+            self._store(key, joined)
+        except Exception as e:
+            self.errors += 1
+            joined = self._stale(key)
+            logging.error(f"Membership lookup failed for {key}, serving {'stale' if joined is not None else 'negative'} answer: {e}")
+            if joined is None:
+                joined = False
+        waiter[1] = joined
+        with self._lock:
+            self._inflight.pop(key, None)
+        waiter[0].set()
+        return joined
+
+    def _store(self, key, joined):
+        with self._lock:
+            previous = self._entries.get(key)
+            now = time.monotonic()
+            self._entries[key] = (joined, now, previous[2] if previous else now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _stale(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[1] < self.stale_ttl:
+                self.stale_served += 1
+                return entry[0]
+        return None
+
+    def start_refresher(self, interval=30, ahead=60):
+        """Refresh recently used joined entries that expire within ``ahead`` seconds."""
+        if self._refresher:
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop, args=(interval, ahead),
+                                           name="membership-refresher", daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self, interval, ahead):
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            with self._lock:
+                due = [key for key, (joined, fetched_at, used_at) in self._entries.items()
+                       if joined and used_at > fetched_at and now - fetched_at > self.positive_ttl - ahead]
+            for key in due:
+                try:
+                    self._store(key, self.fetch(key))
+                    self.refreshed += 1
+                except Exception as e:
+                    logging.error(f"Background membership refresh failed for {key}: {e}")
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {"size": size, "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "stale_served": self.stale_served, "errors": self.errors, "refreshed": self.refreshed}
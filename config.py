@@ -0,0 +1,134 @@
+import os
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+MONGO_URI = os.getenv("MONGO_URI")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_URL2 = os.getenv("WEBHOOK_URL2")
+CHANNEL_ID = os.getenv("CHANNEL_ID")
+OWNER_ID = int(os.getenv("OWNER_ID"))
+
+PRIVATE_GROUP_ID = os.getenv("PRIVATE_GROUP_ID")
+if PRIVATE_GROUP_ID:
+    PRIVATE_GROUP_ID = int(PRIVATE_GROUP_ID)
+else:
+    PRIVATE_GROUP_ID = None
+
+ADMINS = os.getenv("ADMINS")
+if ADMINS:
+    ADMINS = list(map(int, ADMINS.split(',')))
+else:
+    ADMINS = []
+
+# 0 keeps the old behaviour of handling updates inline on the request thread.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+
+FILE_CACHE_SIZE = int(os.getenv("FILE_CACHE_SIZE", "10000"))
+FILE_CACHE_TTL = int(os.getenv("FILE_CACHE_TTL", "600"))
+FILE_CACHE_NEGATIVE_TTL = int(os.getenv("FILE_CACHE_NEGATIVE_TTL", "60"))
+
+SUBSCRIPTION_CACHE_NEGATIVE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_NEGATIVE_TTL", "30"))
+
+MEMBERSHIP_POSITIVE_TTL = int(os.getenv("MEMBERSHIP_POSITIVE_TTL", "600"))
+MEMBERSHIP_NEGATIVE_TTL = int(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "15"))
+MEMBERSHIP_STALE_TTL = int(os.getenv("MEMBERSHIP_STALE_TTL", "3600"))
+MEMBERSHIP_REFRESHER = os.getenv("MEMBERSHIP_REFRESHER", "0") == "1"
+
+# Unverified verification tokens expire after this many seconds; a sweeper clears expired ones
+# from the user documents every TOKEN_SWEEP_INTERVAL seconds (0 disables it).
+UNVERIFIED_TOKEN_TTL = int(os.getenv("UNVERIFIED_TOKEN_TTL", "3600"))
+TOKEN_SWEEP_INTERVAL = int(os.getenv("TOKEN_SWEEP_INTERVAL", "60"))
+
+# Albums are always stored as one link; set UPLOAD_BATCH_LOOSE_FILES=1 to also group
+# separate files an admin posts within UPLOAD_BATCH_WINDOW seconds of each other.
+UPLOAD_BATCH_WINDOW = float(os.getenv("UPLOAD_BATCH_WINDOW", "2"))
+UPLOAD_BATCH_LOOSE_FILES = os.getenv("UPLOAD_BATCH_LOOSE_FILES", "0") == "1"
+
+BOT_METADATA_REFRESH = int(os.getenv("BOT_METADATA_REFRESH", "3600"))
+
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "50"))
+
+# asyncio entry point (async_main.py). Ingest workers only wait on the event loop, so many are cheap.
+ASYNC_INGEST_WORKERS = int(os.getenv("ASYNC_INGEST_WORKERS", "64"))
+ASYNC_HTTP_CONNECTIONS = int(os.getenv("ASYNC_HTTP_CONNECTIONS", "100"))
+
+# Pre-fork serving (gunicorn.conf.py). Token buckets are per process, so without a shared rate
+# budget the global Telegram rate is split across WEB_CONCURRENCY workers.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# "mongo" shares update de-duplication and one-time setup locks across workers and hosts.
+SHARED_STORE = os.getenv("SHARED_STORE", "mongo" if WEB_CONCURRENCY > 1 else "memory")
+# Requires a replica set (Atlas is one); keeps subscription caches of several workers coherent,
+# so it is on by default whenever state is shared.
+SUBSCRIPTION_CHANGE_STREAM = os.getenv("SUBSCRIPTION_CHANGE_STREAM", "1" if SHARED_STORE == "mongo" else "0") == "1"
+# Count the global Telegram rate in the shared store instead, so one busy worker (e.g. running a
+# broadcast) can use the budget the others leave idle.
+TELEGRAM_SHARED_RATE = os.getenv("TELEGRAM_SHARED_RATE", "1" if SHARED_STORE == "mongo" else "0") == "1"
+# Set by the gunicorn master once it has registered the webhook and created indexes.
+APP_SETUP_DONE = os.getenv("APP_SETUP_DONE", "0") == "1"
+
+# Bot API transport. TELEGRAM_API_URL uses telebot's format and can point at a local fake server.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot{0}/{1}")
+# The pool, timeouts and retries apply to the Flask mode (main.py) only.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+
+# Threads delivering the confirmation and file after /verify_success has already answered.
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+
+# Recently issued, still unverified tokens of this worker; lets /verify_final answer them without a
+# MongoDB lookup (tokens from other workers are looked up once and cached).
+LIVE_TOKEN_CACHE_SIZE = int(os.getenv("LIVE_TOKEN_CACHE_SIZE", "100000"))
+
+# Opt-in sampling profiler; collapsed stacks are served on /debug/profile.
+PROFILER = os.getenv("PROFILER", "0") == "1"
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.01"))
+
+# Write-behind buffering of subscription upserts and the event log (0 disables buffering).
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.5"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+EVENT_LOG = os.getenv("EVENT_LOG", "1") == "1"
+
+# Abuse limits: per chat for bot updates, per client IP and per token for the verification routes.
+# A limit of 0 disables it.
+# Proxies in front of the app that append to X-Forwarded-For (0 trusts only the socket address).
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+CHAT_RATE_LIMIT = int(os.getenv("CHAT_RATE_LIMIT", "20"))
+CHAT_RATE_WINDOW = float(os.getenv("CHAT_RATE_WINDOW", "10"))
+# Off unless TRUSTED_PROXY_HOPS is set: behind a proxy every client shares the proxy's address.
+IP_RATE_LIMIT = int(os.getenv("IP_RATE_LIMIT", "60" if TRUSTED_PROXY_HOPS else "0"))
+IP_RATE_WINDOW = float(os.getenv("IP_RATE_WINDOW", "60"))
+# All clients together, per verification route; caps the MongoDB lookups a flood of random tokens causes.
+ROUTE_RATE_LIMIT = int(os.getenv("ROUTE_RATE_LIMIT", "3000"))
+ROUTE_RATE_WINDOW = float(os.getenv("ROUTE_RATE_WINDOW", "10"))
+TOKEN_RATE_LIMIT = int(os.getenv("TOKEN_RATE_LIMIT", "10"))
+TOKEN_RATE_WINDOW = float(os.getenv("TOKEN_RATE_WINDOW", "60"))
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "0") == "1"
+
+# How long a file_id Telegram rejected is remembered as dead.
+DEAD_FILE_TTL = int(os.getenv("DEAD_FILE_TTL", "86400"))
+
+# Link lifecycle: default expiry (seconds) and max deliveries for new uploads, 0 for none; a
+# caption such as "expire=7d uses=100" overrides them per upload. Expired links are archived or
+# purged by a sweeper every LINK_SWEEP_INTERVAL seconds (0 disables it).
+LINK_TTL = int(os.getenv("LINK_TTL", "0"))
+LINK_MAX_USES = int(os.getenv("LINK_MAX_USES", "0"))
+LINK_SWEEP_INTERVAL = int(os.getenv("LINK_SWEEP_INTERVAL", "300"))
+LINK_SWEEP_MODE = os.getenv("LINK_SWEEP_MODE", "archive")
+LINK_SWEEP_BATCH = int(os.getenv("LINK_SWEEP_BATCH", "500"))
+
+# Owner broadcast: concurrent senders (the outbound rate limit still applies), users per
+# checkpointed batch, and seconds between progress edits.
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "200"))
+BROADCAST_REPORT_INTERVAL = int(os.getenv("BROADCAST_REPORT_INTERVAL", "15"))
@@ -0,0 +1,244 @@
+"""Business logic shared by the Flask (main.py) and asyncio (async_main.py) entry points.
+
+Nothing here performs I/O: it builds the texts, keyboards and MongoDB
+documents the handlers send or write, so both modes behave identically.
+"""
+import re
+import secrets
+from datetime import datetime, timedelta
+
+from telebot import types
+
+from config import WEBHOOK_URL2, UNVERIFIED_TOKEN_TTL, LINK_TTL, LINK_MAX_USES
+
+# Membership in this group is never checked.
+MEMBERSHIP_EXEMPT_GROUP = -1002398328247
+MEMBER_STATUSES = ["member", "administrator"]
+SUBSCRIPTION_MINUTES = 10
+DELETE_AFTER = 1200
+
+FORCE_JOIN_TEXT = "*You need to join our compulsory channel 😇\n\nClick the link below to join 🔗:*"
+SUBSCRIPTION_TEXT = ("Your Ads token has expired or you have not subscribed yet. Please refresh your token and subscribe.\n\n"
+                     "Token Timeout: *2 Minutes*\n\n"
+                     "*What is the token?*\n"
+                     "This is an ads token. After completing the process, you can use the bot for 2 minutes.")
+SUBSCRIBED_TEXT = "🎉 *Subscription successful!* You can now use the bot for the next 10 minutes. 😊"
+INVALID_LINK_TEXT = "Invalid or expired link. No file found."
+LINK_USED_UP_TEXT = "This link has reached its download limit or expired."
+FILE_NOT_FOUND_TEXT = "File info not found or expired."
+WAIT_MSG_HANDLE_FILES = "<b>⌛ Please Wait...</b>"
+
+WELCOME_MARKUP = types.InlineKeyboardMarkup(row_width=2)
+WELCOME_MARKUP.add(types.InlineKeyboardButton("Chat Channel", url="https://t.me/+tvWHQ58slElmNmQ1"),
+                   types.InlineKeyboardButton("Close", callback_data="close"))
+
+FILE_PROJECTION = {'file_id': 1, 'file_type': 1, 'expires_at': 1, 'max_uses': 1, '_id': 0}
+LINK_LIMIT_FIELDS = ('expires_at', 'max_uses')
+EXPIRE_OPTION = re.compile(r"\bexpires?[=:](\d+)([smhd]?)\b", re.IGNORECASE)
+USES_OPTION = re.compile(r"\buses[=:](\d+)\b", re.IGNORECASE)
+UNIT_SECONDS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SEND_METHODS = {'photo': 'send_photo', 'video': 'send_video', 'document': 'send_document',
+                'audio': 'send_audio', 'voice': 'send_voice'}
+MEDIA_GROUP_KINDS = {'photo': 'visual', 'video': 'visual', 'document': 'document', 'audio': 'audio'}
+INPUT_MEDIA = {'photo': types.InputMediaPhoto, 'video': types.InputMediaVideo,
+               'document': types.InputMediaDocument, 'audio': types.InputMediaAudio}
+# Bot API error descriptions meaning the file_id itself is unusable, so retrying cannot help.
+DEAD_FILE_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference expired",
+                    "file_reference_expired", "wrong type of the web page content", "failed to get http url content")
+VERIFY_PROJECTION = {"chat_id": 1, "pending_file": 1, "_id": 0}
+SUBSCRIPTION_PROJECTION = {"subscribed_until": 1, "_id": 0}
+ID_PROJECTION = {"_id": 1}
+# Send errors that mean the user can no longer be messaged at all.
+BLOCKED_ERRORS = ("bot was blocked by the user", "user is deactivated", "bot was kicked", "chat not found",
+                  "bot can't initiate conversation")
+BROADCAST_USAGE_TEXT = ("Reply to a message with /broadcast to send it to every user.\n"
+                        "/broadcast status, /broadcast cancel, /broadcast resume")
+
+
+def generate_unique_id(chat_id):
+    random_string = secrets.token_urlsafe(8)
+    return f"{random_string}_{chat_id}"
+
+
+def start_token(message):
+    text_parts = message.text.split(" ")
+    return text_parts[1] if len(text_parts) > 1 else None
+
+
+def membership_shortcut(group_id):
+    """True/False when membership in ``group_id`` needs no API call, otherwise None."""
+    if group_id == MEMBERSHIP_EXEMPT_GROUP:
+        return True
+    if not group_id:
+        return False
+    return None
+
+
+def is_member(status):
+    return status in MEMBER_STATUSES
+
+
+def new_subscription_record(chat_id, file_token=None, file_info=None):
+    """A pending subscription; the file behind ``file_token`` rides along so verification can send it directly."""
+    return {"chat_id": chat_id, "unique_id": generate_unique_id(chat_id), "subscribed_until": None, "verified": False,
+            "token_expires_at": datetime.utcnow() + timedelta(seconds=UNVERIFIED_TOKEN_TTL),
+            "pending_file": {"token": file_token, "file_id": file_info[0], "file_type": file_info[1],
+                             "limits": file_info[2]} if file_info else None}
+
+
+def pending_delivery(user, file_token=None):
+    """``(file_token, file_info)`` to send after verification: the file stored with the subscription when
+    there is one, else ``file_token`` (from older links) with the file still to be looked up."""
+    pending = user.get("pending_file")
+    if pending:
+        return pending["token"], (pending["file_id"], pending["file_type"], pending.get("limits"))
+    return file_token, None
+
+
+def is_dead_file_error(error):
+    description = str(getattr(error, "description", "") or "").lower()
+    return getattr(error, "error_code", None) == 400 and any(marker in description for marker in DEAD_FILE_ERRORS)
+
+
+def is_blocked_error(error):
+    description = str(getattr(error, "description", "") or "").lower()
+    return getattr(error, "error_code", None) in (400, 403) and any(marker in description for marker in BLOCKED_ERRORS)
+
+
+def broadcast_text(progress):
+    if not progress:
+        return "No broadcast has run yet."
+    eta = progress["eta_seconds"]
+    return (f"Broadcast {progress['state']}: {progress['processed']}/{progress['total']}\n"
+            f"Sent {progress['sent']}, failed {progress['failed']}, blocked {progress['blocked']}\n"
+            f"{progress['per_second']} msgs/s, ETA {'-' if eta is None else timedelta(seconds=eta)}")
+
+
+def unverified_token(unique_id):
+    """Filter for a user whose verification token ``unique_id`` has not been used yet."""
+    return {"unique_id": unique_id, "verified": False}
+
+
+def verification_update(unique_id):
+    """Filter and update that consume a verification token; an already verified token no longer matches."""
+    subscribed_until = datetime.utcnow() + timedelta(minutes=SUBSCRIPTION_MINUTES)
+    return subscribed_until, unverified_token(unique_id), \
+        {"$set": {"verified": True, "subscribed_until": subscribed_until}, "$unset": {"token_expires_at": "", "pending_file": ""}}
+
+
+def subscription_markup(unique_id, file_token=None):
+    subscription_link = f"{WEBHOOK_URL2}/verify/{unique_id}"
+    if file_token:
+        subscription_link += f"?file_token={file_token}"
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    markup.add(types.InlineKeyboardButton("Subscribe Here", url=subscription_link),
+               types.InlineKeyboardButton("Close", callback_data="close"))
+    return markup
+
+
+def welcome_text(message):
+    user_name = message.from_user.first_name or message.from_user.username
+    return f"Hello, *{user_name}*! 😉\n\nYou have successfully subscribed and joined our channel."
+
+
+def stored_text(first_name, bot_username, unique_id, count=1):
+    shareable_link = f"https://t.me/{bot_username}?start={unique_id}"
+    what, it = ("your file is", "it") if count == 1 else (f"your {count} files are", "them")
+    return (f"<b>{first_name}, {what} stored!</b>\n\n"
+            f"<code>Use this link to access {it} 🔗 :\n||{shareable_link}||\n\nLeave Reaction 🤪😇</code>\n\n{shareable_link}")
+
+
+def extract_file_info(message):
+    if message.photo:
+        return (message.photo[-1].file_id, 'photo')
+    elif message.video:
+        return (message.video.file_id, 'video')
+    elif message.document:
+        return (message.document.file_id, 'document')
+    elif message.audio:
+        return (message.audio.file_id, 'audio')
+    elif message.voice:
+        return (message.voice.file_id, 'voice')
+    return None
+
+
+def file_info_from_document(document, now=None):
+    """``(file_id, file_type, limits)`` for a stored link, or None when it is missing or expired."""
+    if not document or link_expired(document, now):
+        return None
+    limits = {field: document[field] for field in LINK_LIMIT_FIELDS if document.get(field)}
+    return (document['file_id'], document['file_type'], limits or None)
+
+
+def link_expired(limits, now=None):
+    expires_at = limits.get('expires_at') if limits else None
+    return bool(expires_at) and expires_at <= (now or datetime.utcnow())
+
+
+def link_options(caption, now=None):
+    """Expiry and max-use fields for a new link: caption options ("expire=7d", "uses=100") or the defaults."""
+    ttl, max_uses = LINK_TTL, LINK_MAX_USES
+    expire = EXPIRE_OPTION.search(caption or "")
+    if expire:
+        ttl = int(expire.group(1)) * UNIT_SECONDS[expire.group(2).lower()]
+    uses = USES_OPTION.search(caption or "")
+    if uses:
+        max_uses = int(uses.group(1))
+    options = {}
+    if ttl:
+        options['expires_at'] = (now or datetime.utcnow()) + timedelta(seconds=ttl)
+    if max_uses:
+        options['max_uses'] = max_uses
+        options['uses'] = 0
+    return options
+
+
+def use_link(unique_id, now=None):
+    """Filter and update that count one delivery of a link, matching only while it is unexpired and has uses left."""
+    now = now or datetime.utcnow()
+    return {'unique_id': unique_id,
+            '$and': [{'$or': [{'expires_at': None}, {'expires_at': {'$gt': now}}]},
+                     {'$or': [{'max_uses': None}, {'$expr': {'$lt': ['$uses', '$max_uses']}}]}]}, {'$inc': {'uses': 1}}
+
+
+def expired_links(now=None):
+    """Filter for links past their expiry or out of uses; both branches are served by sparse indexes."""
+    return {'$or': [{'expires_at': {'$lte': now or datetime.utcnow()}},
+                    {'max_uses': {'$gt': 0}, '$expr': {'$gte': ['$uses', '$max_uses']}}]}
+
+
+def expired_tokens(now=None):
+    """Filter and update that retire unverified tokens past their expiry while keeping the user's document."""
+    return {"token_expires_at": {"$lte": now or datetime.utcnow()}}, \
+        {"$unset": {"unique_id": "", "token_expires_at": "", "pending_file": ""}}
+
+
+def batch_upsert(link_id, messages):
+    """Filter and update that store a batch, merging album parts collected by different workers."""
+    first = messages[0]
+    files = [list(extract_file_info(m)) for m in messages]
+    caption = next((m.caption for m in messages if m.caption), None)
+    update = {'$push': {'file_id': {'$each': files}}, '$setOnInsert': {'file_type': 'batch', **link_options(caption)}}
+    if not first.media_group_id:
+        return {'unique_id': link_id}, update
+    update['$setOnInsert']['unique_id'] = link_id
+    return {'media_group_id': f"{first.chat.id}:{first.media_group_id}"}, update
+
+
+def media_groups(files):
+    """Split a batch into sendable groups: (None, [single]) or (kind, [up to 10 album items]).
+
+    Telegram only mixes photos with videos in one album, caps albums at 10 and has no voice albums.
+    """
+    groups = []
+    for file_id, file_type in files:
+        kind = MEDIA_GROUP_KINDS.get(file_type)
+        if kind and groups and groups[-1][0] == kind and len(groups[-1][1]) < 10:
+            groups[-1][1].append((file_id, file_type))
+        else:
+            groups.append((kind, [(file_id, file_type)]))
+    return [(kind if len(items) > 1 else None, items) for kind, items in groups]
+
+
+def input_media(items):
+    return [INPUT_MEDIA[file_type](file_id) for file_id, file_type in items]
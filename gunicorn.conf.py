@@ -0,0 +1,44 @@
+# Production serving: gunicorn -c gunicorn.conf.py 'main:create_app()'
+# asyncio mode:       gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker async_main:app
+import os
+import multiprocessing
+
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+timeout = 30
+keepalive = 5
+# Workers start their own background threads (scheduler, ingestor, refreshers), so the
+# app must be imported after fork, not in the master.
+preload_app = False
+
+# Workers read these from config.py after fork.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+
+def on_starting(server):
+    """Register the webhook and create indexes once, in the master, before any worker starts."""
+    import certifi
+    from pymongo import MongoClient
+    from pymongo.server_api import ServerApi
+    from config import MONGO_URI
+    from indexes import ensure_indexes
+    from store import make_store
+    from transport import TelegramTransport
+    from webhook import set_webhook_once
+
+    client = MongoClient(MONGO_URI, server_api=ServerApi('1'), tlsCAFile=certifi.where())
+    try:
+        db = client["media_shortener"]
+        indexes_ready = ensure_indexes(db)
+        webhook_ready = set_webhook_once(make_store("mongo", db), transport=TelegramTransport())
+        # Workers skip both steps only when both succeeded here; otherwise each runs them itself.
+        if indexes_ready and webhook_ready:
+            os.environ["APP_SETUP_DONE"] = "1"
+        else:
+            server.log.error("One-time setup failed, workers will retry it.")
+    except Exception as e:
+        server.log.error(f"One-time setup failed, workers will retry it: {e}")
+    finally:
+        client.close()
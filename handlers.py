@@ -0,0 +1,559 @@
+"""Bot handlers and verification routes shared by the Flask (main.py) and asyncio (async_main.py) modes.
+
+The flow is written once, as coroutines, against a small I/O backend.
+``SyncIO`` makes blocking pymongo and telebot calls; none of its awaits
+ever suspends, so ``run_sync`` drives the coroutines to completion on the
+calling thread without an event loop. ``AsyncIO`` awaits Motor and
+AsyncTeleBot on the server's loop. The entry points only build the
+clients and translate requests and responses.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+import core
+from config import (WEBHOOK_URL2, CHANNEL_ID, OWNER_ID, PRIVATE_GROUP_ID, ADMINS,
+                    FILE_CACHE_SIZE, FILE_CACHE_TTL, FILE_CACHE_NEGATIVE_TTL, SUBSCRIPTION_CACHE_NEGATIVE_TTL,
+                    SUBSCRIPTION_CHANGE_STREAM, MEMBERSHIP_POSITIVE_TTL, MEMBERSHIP_NEGATIVE_TTL, MEMBERSHIP_STALE_TTL,
+                    MEMBERSHIP_REFRESHER, UPLOAD_BATCH_WINDOW, UPLOAD_BATCH_LOOSE_FILES, BOT_METADATA_REFRESH,
+                    DELETE_BATCH_SIZE, UNVERIFIED_TOKEN_TTL, LIVE_TOKEN_CACHE_SIZE,
+                    WRITE_BEHIND_INTERVAL, WRITE_BEHIND_BATCH, WRITE_BEHIND_MAX_PENDING, EVENT_LOG,
+                    CHAT_RATE_LIMIT, CHAT_RATE_WINDOW, IP_RATE_LIMIT, IP_RATE_WINDOW, ROUTE_RATE_LIMIT, ROUTE_RATE_WINDOW,
+                    TOKEN_RATE_LIMIT, TOKEN_RATE_WINDOW,
+                    TRUSTED_PROXY_HOPS, RATE_LIMIT_SHARED, DEAD_FILE_TTL,
+                    LINK_SWEEP_INTERVAL, LINK_SWEEP_MODE, LINK_SWEEP_BATCH, TOKEN_SWEEP_INTERVAL,
+                    BROADCAST_WORKERS, BROADCAST_BATCH, BROADCAST_REPORT_INTERVAL)
+from caching import TTLCache, SubscriptionCache, MembershipCache, LiveTokens, MISSING
+from scheduler import DeletionScheduler
+from ingest import update_chat_id
+from outbound import USER, BACKGROUND
+from ids import insert_with_new_id
+from batching import UploadBatcher, store_batches
+from metadata import BotMetadata
+from pages import PageRenderer
+from writebehind import WriteBehind, EventLog
+from ratelimit import SlidingWindowLimiter, client_ip
+from lifecycle import LinkSweeper, TokenSweeper
+from broadcast import Broadcaster
+from metrics import HANDLER_SECONDS, EVENTS
+
+HTML = {"Content-Type": "text/html; charset=utf-8"}
+
+
+def run_sync(coroutine):
+    """Run a coroutine that never suspends (one driven by ``SyncIO``) to completion on this thread."""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("A shared handler awaited real asynchronous I/O under SyncIO")
+
+
+class SyncIO:
+    """Blocking backend for the threaded Flask mode."""
+
+    def __init__(self, outbound, delivery_workers=4):
+        self.outbound = outbound
+        # Confirmation and file delivery after /verify_success run here so the browser is answered at once.
+        self.delivery_pool = ThreadPoolExecutor(max_workers=delivery_workers, thread_name_prefix="verify-delivery")
+
+    async def telegram(self, chat_id, fn, *args, priority=USER, **kwargs):
+        return self.outbound.call(chat_id, fn, *args, priority=priority, **kwargs)
+
+    async def db(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    async def blocking(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    def from_thread(self, fn, *args, **kwargs):
+        """Call ``fn`` from a background thread and return its result, running a returned coroutine."""
+        result = fn(*args, **kwargs)
+        return run_sync(result) if inspect.iscoroutine(result) else result
+
+    def spawn(self, coroutine):
+        self.delivery_pool.submit(run_sync, coroutine)
+
+    def handler(self, fn):
+        """Adapt a shared coroutine handler to telebot's synchronous callbacks."""
+        @functools.wraps(fn)
+        def callback(*args):
+            return run_sync(fn(*args))
+        return callback
+
+
+class AsyncIO:
+    """Backend for the asyncio mode; ``loop`` must be set once the server's event loop runs."""
+
+    def __init__(self, outbound):
+        self.outbound = outbound
+        self.loop = None
+        # Deliveries started by /verify_success; referenced here so they are not collected.
+        self._tasks = set()
+
+    async def telegram(self, chat_id, fn, *args, priority=USER, **kwargs):
+        return await self.outbound.call_async(chat_id, fn, *args, priority=priority, **kwargs)
+
+    async def db(self, fn, *args, **kwargs):
+        return await fn(*args, **kwargs)
+
+    async def blocking(self, fn, *args, **kwargs):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    def from_thread(self, fn, *args, **kwargs):
+        """Call ``fn`` from a background thread and wait for it; a returned coroutine runs on the loop."""
+        result = fn(*args, **kwargs)
+        if inspect.iscoroutine(result):
+            return asyncio.run_coroutine_threadsafe(result, self.loop).result()
+        return result
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def handler(self, fn):
+        return fn
+
+
+class Handlers:
+    """Every bot handler and verification route, plus the caches, limiters and jobs they use.
+
+    ``db`` is the mode's own database (pymongo or Motor) and is only used
+    through ``io.db``; ``sync_db`` is a pymongo database for the thread-based
+    jobs (in the asyncio mode, Motor's ``delegate``).
+    """
+
+    def __init__(self, bot, io, db, sync_db, shared_store):
+        self.bot = bot
+        self.io = io
+        self.users = db["users"]
+        self.files = db["file_storage"]
+        self.sync_users = sync_db["users"]
+        self.sync_files = sync_db["file_storage"]
+
+        # Floods are shed here, before they reach MongoDB or Telegram.
+        limit_store = shared_store if RATE_LIMIT_SHARED else None
+        self.chat_limiter = SlidingWindowLimiter("chat", CHAT_RATE_LIMIT, CHAT_RATE_WINDOW, store=limit_store)
+        self.ip_limiter = SlidingWindowLimiter("ip", IP_RATE_LIMIT, IP_RATE_WINDOW, store=limit_store)
+        self.route_limiter = SlidingWindowLimiter("route", ROUTE_RATE_LIMIT, ROUTE_RATE_WINDOW, store=limit_store)
+        self.token_limiter = SlidingWindowLimiter("token", TOKEN_RATE_LIMIT, TOKEN_RATE_WINDOW, store=limit_store)
+
+        self.file_cache = TTLCache(maxsize=FILE_CACHE_SIZE, ttl=FILE_CACHE_TTL, negative_ttl=FILE_CACHE_NEGATIVE_TTL)
+        self.subscription_cache = SubscriptionCache(negative_ttl=SUBSCRIPTION_CACHE_NEGATIVE_TTL)
+        self.membership_cache = MembershipCache(self.fetch_membership, positive_ttl=MEMBERSHIP_POSITIVE_TTL,
+                                                negative_ttl=MEMBERSHIP_NEGATIVE_TTL, stale_ttl=MEMBERSHIP_STALE_TTL)
+        # file_ids (or media group id lists) Telegram rejected; sends to them are skipped instead of retried.
+        self.dead_files = TTLCache(maxsize=FILE_CACHE_SIZE, ttl=DEAD_FILE_TTL)
+        self.live_tokens = LiveTokens(maxsize=LIVE_TOKEN_CACHE_SIZE, ttl=UNVERIFIED_TOKEN_TTL)
+        self.pages = PageRenderer({"webhook_url2": WEBHOOK_URL2})
+        self.bot_metadata = BotMetadata(bot, CHANNEL_ID, refresh_interval=BOT_METADATA_REFRESH)
+
+        self.subscription_writes = WriteBehind(self.sync_users, "users", interval=WRITE_BEHIND_INTERVAL,
+                                               batch_size=WRITE_BEHIND_BATCH, max_pending=WRITE_BEHIND_MAX_PENDING)
+        self.event_log = EventLog(WriteBehind(sync_db["events"], "events", interval=WRITE_BEHIND_INTERVAL,
+                                              batch_size=WRITE_BEHIND_BATCH, max_pending=WRITE_BEHIND_MAX_PENDING),
+                                  enabled=EVENT_LOG)
+
+        # The jobs below run on their own threads and reach Telegram through ``io.from_thread``.
+        self.deletion_scheduler = DeletionScheduler(self.delete_message_background, sync_db["scheduled_deletions"],
+                                                    batch_size=DELETE_BATCH_SIZE)
+        self.link_sweeper = LinkSweeper(self.sync_files, sync_db["file_storage_archive"], mode=LINK_SWEEP_MODE,
+                                        batch_size=LINK_SWEEP_BATCH, interval=LINK_SWEEP_INTERVAL, lock=shared_store)
+        self.token_sweeper = TokenSweeper(self.sync_users, interval=TOKEN_SWEEP_INTERVAL, lock=shared_store)
+        self.broadcaster = Broadcaster(self.sync_users, sync_db["broadcasts"], self.copy_message_background,
+                                       workers=BROADCAST_WORKERS, batch_size=BROADCAST_BATCH,
+                                       report_interval=BROADCAST_REPORT_INTERVAL)
+        self.upload_batcher = UploadBatcher(lambda batches: io.from_thread(self.save_upload_batches, batches),
+                                            window=UPLOAD_BATCH_WINDOW)
+
+    def register(self):
+        """Register the handlers on ``bot``, in the order telebot should try them."""
+        self.bot.register_message_handler(self.io.handler(self.handle_start), commands=["start"])
+        self.bot.register_message_handler(self.io.handler(self.handle_broadcast), commands=["broadcast"],
+                                          func=lambda message: message.from_user.id == OWNER_ID)
+        self.bot.register_callback_query_handler(self.io.handler(self.close_button), func=lambda call: call.data == "close")
+        self.bot.register_message_handler(
+            self.io.handler(self.handle_files),
+            func=lambda message: (PRIVATE_GROUP_ID and message.chat.id == PRIVATE_GROUP_ID) and (message.from_user.id in ADMINS),
+            content_types=['photo', 'video', 'document', 'audio', 'voice'])
+
+    def start_jobs(self):
+        """Start the background jobs that need no startup ordering; the deletion scheduler is started separately."""
+        if SUBSCRIPTION_CHANGE_STREAM:
+            self.subscription_cache.watch(self.sync_users)
+        if MEMBERSHIP_REFRESHER:
+            self.membership_cache.start_refresher()
+        self.link_sweeper.start()
+        self.token_sweeper.start()
+
+    # Thread-side callbacks of the background jobs.
+
+    def delete_message_background(self, chat_id, message_id):
+        self.io.from_thread(self.io.telegram, chat_id, self.bot.delete_message, chat_id, message_id, priority=BACKGROUND)
+
+    def copy_message_background(self, chat_id, from_chat_id, message_id):
+        self.io.from_thread(self.io.telegram, chat_id, self.bot.copy_message, chat_id, from_chat_id, message_id,
+                            priority=BACKGROUND)
+
+    def fetch_membership(self, key):
+        group_id, chat_id = key
+        return core.is_member(self.io.from_thread(self.bot.get_chat_member, group_id, chat_id).status)
+
+    # Shared flow.
+
+    async def send(self, chat_id, fn, *args, **kwargs):
+        return await self.io.telegram(chat_id, fn, chat_id, *args, **kwargs)
+
+    async def check_subscription(self, chat_id):
+        cached = self.subscription_cache.get(chat_id)
+        if cached is not MISSING:
+            return cached
+        user = await self.io.db(self.users.find_one, {"chat_id": chat_id}, core.SUBSCRIPTION_PROJECTION)
+        subscribed_until = user.get("subscribed_until") if user else None
+        self.subscription_cache.update(chat_id, subscribed_until)
+        if subscribed_until:
+            return datetime.utcnow() < subscribed_until
+        return False
+
+    async def user_joined_channel(self, chat_id, group_id):
+        shortcut = core.membership_shortcut(group_id)
+        if shortcut is not None:
+            return shortcut
+        joined = self.membership_cache.peek((group_id, chat_id))
+        if joined is MISSING:
+            joined = await self.io.blocking(self.membership_cache.load, (group_id, chat_id))
+        return joined
+
+    async def send_force_subscribe_message(self, chat_id):
+        try:
+            await self.bot_metadata.ensure()
+            await self.send(chat_id, self.bot.send_message, core.FORCE_JOIN_TEXT, reply_markup=self.bot_metadata.join_markup,
+                            parse_mode="Markdown")
+        except Exception as e:
+            logging.error(f"Failed to send force-join message: {e}")
+
+    async def send_subscription_message(self, chat_id, unique_id, file_token=None):
+        try:
+            await self.send(chat_id, self.bot.send_message, core.SUBSCRIPTION_TEXT, parse_mode="Markdown",
+                            reply_markup=core.subscription_markup(unique_id, file_token))
+        except Exception as e:
+            logging.error(f"Failed to send subscription message: {e}")
+
+    async def send_welcome_message(self, message):
+        try:
+            await self.send(message.chat.id, self.bot.send_message, core.welcome_text(message), parse_mode="Markdown",
+                            reply_markup=core.WELCOME_MARKUP)
+        except Exception as e:
+            logging.error(f"Failed to send welcome message: {e}")
+
+    async def start_subscription(self, chat_id, file_token=None, file_info=None):
+        subscription_record = core.new_subscription_record(chat_id, file_token, file_info)
+        # Nothing reads the record back before the user has gone through the verification pages.
+        # A user who comes back is no longer skipped by broadcasts.
+        upsert = UpdateOne({"chat_id": chat_id}, {"$set": subscription_record, "$unset": {"blocked": ""}}, upsert=True)
+        if not self.subscription_writes.add(upsert, key=chat_id):
+            await self.io.db(self.users.bulk_write, [upsert])
+        self.subscription_cache.update(chat_id, None)
+        self.live_tokens.issue(chat_id, subscription_record["unique_id"])
+        EVENTS.inc("subscription_started")
+        logging.info(f"Subscription record created for {chat_id}.")
+        await self.send_subscription_message(chat_id, subscription_record["unique_id"], file_token=file_token)
+
+    @HANDLER_SECONDS.time("handle_start")
+    async def handle_start(self, message):
+        chat_id = message.chat.id
+        file_token = core.start_token(message)
+        self.event_log.record("start", chat_id, file_token=file_token)
+        if file_token:
+            file_info = await self.load_file_storage(file_token)
+            if file_info:
+                if not await self.check_subscription(chat_id):
+                    await self.start_subscription(chat_id, file_token=file_token, file_info=file_info)
+                    return
+                if chat_id != OWNER_ID and not await self.user_joined_channel(chat_id, CHANNEL_ID):
+                    await self.send_force_subscribe_message(chat_id)
+                    return
+                await self.deliver_file(chat_id, file_token, file_info)
+            else:
+                await self.send(chat_id, self.bot.send_message, core.INVALID_LINK_TEXT)
+            return
+        if await self.check_subscription(chat_id):
+            if chat_id == OWNER_ID or await self.user_joined_channel(chat_id, CHANNEL_ID):
+                await self.send_welcome_message(message)
+            else:
+                await self.send_force_subscribe_message(chat_id)
+        else:
+            await self.start_subscription(chat_id)
+
+    async def save_file_storage(self, file_info, options=None):
+        try:
+            unique_id = await self.io.blocking(insert_with_new_id, self.sync_files,
+                                               {'file_id': file_info[0], 'file_type': file_info[1], **(options or {})})
+            self.file_cache.invalidate(unique_id)
+            logging.info(f"File {unique_id} saved to the database.")
+            return unique_id
+        except Exception as e:
+            logging.error(f"Failed to save file {file_info[0]}: {e}")
+            return None
+
+    async def load_file_storage(self, unique_id):
+        cached = self.file_cache.get(unique_id)
+        if cached is not MISSING:
+            return None if cached and core.link_expired(cached[2]) else cached
+        try:
+            document = await self.io.db(self.files.find_one, {'unique_id': unique_id}, core.FILE_PROJECTION)
+            result = core.file_info_from_document(document)
+            self.file_cache.set(unique_id, result)
+            return result
+        except Exception as e:
+            logging.error(f"Failed to load file {unique_id}: {e}")
+            return None
+
+    @HANDLER_SECONDS.time("handle_broadcast")
+    async def handle_broadcast(self, message):
+        chat_id = message.chat.id
+        action = core.start_token(message)
+        try:
+            if action == "cancel":
+                text = "Broadcast cancelled." if await self.io.blocking(self.broadcaster.cancel) else "No broadcast is running."
+            elif action == "status":
+                text = core.broadcast_text(await self.io.blocking(self.broadcaster.latest))
+            elif action == "resume" or message.reply_to_message:
+                status = await self.send(chat_id, self.bot.send_message, "Starting broadcast...")
+                # Progress is reported from the broadcast thread.
+                report = lambda progress: self.io.from_thread(
+                    self.io.telegram, chat_id, self.bot.edit_message_text, core.broadcast_text(progress),
+                    chat_id, status.message_id, priority=BACKGROUND)
+                if action == "resume":
+                    job = await self.io.blocking(self.broadcaster.resume, report)
+                else:
+                    job = await self.io.blocking(self.broadcaster.start, chat_id, message.reply_to_message.message_id, report)
+                if job:
+                    await self.io.blocking(report, self.broadcaster.progress())
+                    return
+                text = "No interrupted broadcast to resume." if action == "resume" else "A broadcast is already running."
+                await self.io.telegram(chat_id, self.bot.edit_message_text, text, chat_id, status.message_id)
+                return
+            else:
+                text = core.BROADCAST_USAGE_TEXT
+            await self.send(chat_id, self.bot.send_message, text)
+        except Exception as e:
+            logging.error(f"Broadcast command failed: {e}")
+            await self.send(chat_id, self.bot.send_message, f"Error: {e}")
+
+    async def close_button(self, call):
+        try:
+            await self.send(call.message.chat.id, self.bot.delete_message, call.message.message_id)
+        except Exception as e:
+            logging.error(f"Failed to delete message with buttons: {e}")
+
+    async def send_live_file(self, chat_id, key, method, *args, **kwargs):
+        """Send a file unless ``key`` is known to be dead on Telegram; marks it dead when Telegram rejects it."""
+        if self.dead_files.get(key) is True:
+            EVENTS.inc("dead_file_skipped")
+            await self.send(chat_id, self.bot.send_message, core.FILE_NOT_FOUND_TEXT)
+            return None
+        try:
+            return await self.send(chat_id, method, *args, **kwargs)
+        except Exception as e:
+            if not core.is_dead_file_error(e):
+                raise
+            self.dead_files.set(key, True)
+            EVENTS.inc("dead_file")
+            logging.warning(f"File {key} is no longer available on Telegram: {e}")
+            await self.send(chat_id, self.bot.send_message, core.FILE_NOT_FOUND_TEXT)
+            return None
+
+    async def deliver_file(self, chat_id, file_token, file_info):
+        """Send a stored link's file, counting the use atomically when the link has an expiry or use limit."""
+        limits = file_info[2]
+        if limits:
+            used = not core.link_expired(limits) and (
+                not limits.get('max_uses')
+                or await self.io.db(self.files.find_one_and_update, *core.use_link(file_token), core.ID_PROJECTION))
+            if not used:
+                self.file_cache.invalidate(file_token)
+                EVENTS.inc("link_expired")
+                await self.send(chat_id, self.bot.send_message, core.LINK_USED_UP_TEXT)
+                return
+        await self.send_file(chat_id, file_info[0], file_info[1])
+
+    @HANDLER_SECONDS.time("send_file")
+    async def send_file(self, chat_id, file_id, file_type):
+        try:
+            if file_type == 'batch':
+                await self.send_file_batch(chat_id, file_id)
+            elif file_type in core.SEND_METHODS:
+                sent_message = await self.send_live_file(chat_id, file_id, getattr(self.bot, core.SEND_METHODS[file_type]),
+                                                         file_id, protect_content=True)
+                if sent_message is None:
+                    return
+                EVENTS.inc("file_sent")
+                self.event_log.record("file_sent", chat_id, file_type=file_type)
+                await self.schedule_delete_message(chat_id, sent_message.message_id)
+        except Exception as e:
+            logging.error(f"Failed to send the file: {e}")
+
+    async def send_file_batch(self, chat_id, files):
+        for kind, items in core.media_groups(files):
+            if kind is None:
+                await self.send_file(chat_id, *items[0])
+                continue
+            group_key = "|".join(file_id for file_id, _ in items)
+            sent_messages = await self.send_live_file(chat_id, group_key, self.bot.send_media_group,
+                                                      core.input_media(items), protect_content=True)
+            if sent_messages is None:
+                continue
+            EVENTS.inc("file_sent", amount=len(items))
+            self.event_log.record("file_sent", chat_id, file_type=kind, count=len(items))
+            for sent_message in sent_messages:
+                await self.schedule_delete_message(chat_id, sent_message.message_id)
+
+    async def schedule_delete_message(self, chat_id, message_id, delay=core.DELETE_AFTER):
+        await self.io.blocking(self.deletion_scheduler.schedule, chat_id, message_id, delay)
+
+    @HANDLER_SECONDS.time("handle_files")
+    async def handle_files(self, message):
+        chat_id = message.chat.id
+        try:
+            file_info = core.extract_file_info(message)
+            if file_info and (message.media_group_id or UPLOAD_BATCH_LOOSE_FILES):
+                self.upload_batcher.add((chat_id, message.from_user.id, message.media_group_id), message)
+                return
+            unique_id = await self.save_file_storage(file_info, core.link_options(message.caption)) if file_info else None
+            if unique_id:
+                await self.bot_metadata.ensure()
+                processing_msg = await self.send(chat_id, self.bot.send_message, core.WAIT_MSG_HANDLE_FILES, parse_mode='HTML')
+                await self.io.telegram(chat_id, self.bot.edit_message_text,
+                                       core.stored_text(message.from_user.first_name, self.bot_metadata.username, unique_id),
+                                       chat_id, processing_msg.message_id, parse_mode='HTML')
+            else:
+                await self.io.telegram(chat_id, self.bot.reply_to, message, 'Failed to process the file.')
+        except Exception as e:
+            await self.io.telegram(chat_id, self.bot.reply_to, message, f"Error: {e}")
+
+    async def save_upload_batches(self, batches):
+        link_ids = await self.io.blocking(store_batches, self.sync_files, batches)
+        await self.bot_metadata.ensure()
+        for link_id, messages in zip(link_ids, batches):
+            first = messages[0]
+            if link_id is False:
+                await self.io.telegram(first.chat.id, self.bot.reply_to, first, 'Failed to process the files.')
+            elif link_id:
+                self.file_cache.invalidate(link_id)
+                await self.io.telegram(first.chat.id, self.bot.reply_to, first,
+                                       core.stored_text(first.from_user.first_name, self.bot_metadata.username, link_id,
+                                                        len(messages)),
+                                       parse_mode='HTML')
+
+    # Abuse limits.
+
+    async def allow(self, limiter, key):
+        # A shared store means a MongoDB round trip, which must not block the event loop.
+        return limiter.allow(key) if limiter.store is None else await self.io.blocking(limiter.allow, key)
+
+    async def update_allowed(self, update):
+        chat_id = update_chat_id(update)
+        if chat_id in (0, OWNER_ID, PRIVATE_GROUP_ID) or await self.allow(self.chat_limiter, chat_id):
+            return True
+        EVENTS.inc("rate_limited_chat")
+        return False
+
+    async def verification_allowed(self, route, unique_id, remote_addr, headers):
+        if not await self.allow(self.ip_limiter, client_ip(remote_addr, headers.get("X-Forwarded-For"), TRUSTED_PROXY_HOPS)):
+            EVENTS.inc("rate_limited_ip")
+            return False
+        # Random tokens each get a fresh token bucket, so the route as a whole is capped first.
+        if not await self.allow(self.route_limiter, route):
+            EVENTS.inc("rate_limited_route")
+            return False
+        if not await self.allow(self.token_limiter, unique_id):
+            EVENTS.inc("rate_limited_token")
+            return False
+        return True
+
+    # Verification routes. Pages return ``(status, body, headers)``, /verify_success ``(status, json)``.
+
+    def render_page(self, name, unique_id, headers):
+        return self.pages.render(name, unique_id, headers.get("Accept-Encoding"), headers.get("If-None-Match"))
+
+    def page(self, name, unique_id, headers):
+        try:
+            return self.render_page(name, unique_id, headers)
+        except Exception as e:
+            logging.error(f"Error rendering {name}: {e}")
+            return 500, "<h1>Something went wrong.</h1>", HTML
+
+    async def verify_final(self, unique_id, remote_addr, headers):
+        try:
+            if not await self.verification_allowed("verify_final", unique_id, remote_addr, headers):
+                return 429, "<h1>Too many requests. Please try again later.</h1>", HTML
+            live = self.live_tokens.get(unique_id)
+            if live is MISSING:
+                user = await self.io.db(self.users.find_one, core.unverified_token(unique_id), core.ID_PROJECTION)
+                live = True if user else None
+                self.live_tokens.set(unique_id, live)
+            if not live:
+                return 400, "<h1>Invalid or expired token. Please try again.</h1>", HTML
+            return self.render_page("complete_subscription.html", unique_id, headers)
+        except Exception as e:
+            logging.error(f"Error rendering final verification page: {e}")
+            return 500, "<h1>Something went wrong.</h1>", HTML
+
+    async def deliver_verification(self, chat_id, file_token, file_info=None):
+        try:
+            await self.send(chat_id, self.bot.send_message, core.SUBSCRIBED_TEXT, parse_mode="Markdown")
+            if file_token:
+                # Links verified before the file was stored with the subscription still need the lookup.
+                file_info = file_info or await self.load_file_storage(file_token)
+                if file_info:
+                    await self.deliver_file(chat_id, file_token, file_info)
+                else:
+                    await self.send(chat_id, self.bot.send_message, core.FILE_NOT_FOUND_TEXT)
+        except Exception as e:
+            logging.error(f"Failed to deliver verification to {chat_id}: {e}")
+
+    async def verify_success(self, unique_id, remote_addr, headers, file_token=None):
+        try:
+            if not await self.verification_allowed("verify_success", unique_id, remote_addr, headers):
+                return 429, {"message": "Too many requests. Please try again later."}
+            subscribed_until, query, update = core.verification_update(unique_id)
+            user = await self.io.db(self.users.find_one_and_update, query, update, core.VERIFY_PROJECTION)
+            if not user:
+                EVENTS.inc("verification_rejected")
+                return 400, {"message": "Invalid or expired token."}
+            chat_id = user["chat_id"]
+            EVENTS.inc("verification")
+            self.event_log.record("verification", chat_id)
+            self.subscription_cache.update(chat_id, subscribed_until)
+            self.live_tokens.set(unique_id, None)
+            self.io.spawn(self.deliver_verification(chat_id, *core.pending_delivery(user, file_token)))
+            return 200, {"message": "Subscription verified successfully!"}
+        except Exception as e:
+            logging.error(f"Error verifying subscription: {e}")
+            return 500, {"message": "An error occurred."}
+
+    def stats(self):
+        return {"deletions": self.deletion_scheduler.stats(),
+                "file_cache": self.file_cache.stats(),
+                "dead_files": self.dead_files.stats(),
+                "links": self.link_sweeper.stats(),
+                "tokens": self.token_sweeper.stats(),
+                "broadcast": self.broadcaster.stats(),
+                "subscription_cache": self.subscription_cache.stats(),
+                "membership_cache": self.membership_cache.stats(),
+                "upload_batches": self.upload_batcher.stats(),
+                "bot_metadata": self.bot_metadata.stats(),
+                "pages": self.pages.stats(),
+                "live_tokens": self.live_tokens.stats(),
+                "subscription_writes": self.subscription_writes.stats(),
+                "event_log": self.event_log.stats(),
+                "rate_limits": {limiter.name: limiter.stats()
+                                for limiter in (self.chat_limiter, self.ip_limiter, self.route_limiter, self.token_limiter)}}
@@ -0,0 +1,46 @@
+import secrets
+import string
+import time
+
+from pymongo.errors import DuplicateKeyError
+
+# Digits sort before letters in ASCII, so ids of equal length sort by creation time.
+ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+TIME_CHARS = 7
+RANDOM_CHARS = 6
+
+
+def _encode(value, width):
+    chars = []
+    for _ in range(width):
+        value, rem = divmod(value, 62)
+        chars.append(ALPHABET[rem])
+    return "".join(reversed(chars))
+
+
+def new_link_id(now=None):
+    """13-character, time-sortable, URL-safe id (ms timestamp + random suffix)."""
+    millis = int((time.time() if now is None else now) * 1000)
+    return _encode(millis, TIME_CHARS) + "".join(secrets.choice(ALPHABET) for _ in range(RANDOM_CHARS))
+
+
+def allocate_link_ids(count):
+    """Pre-allocate ``count`` distinct ids for a batch upload."""
+    now = time.time()
+    ids = set()
+    while len(ids) < count:
+        ids.add(new_link_id(now))
+    return sorted(ids)
+
+
+def insert_with_new_id(collection, document, field="unique_id", attempts=5):
+    """Insert ``document`` under a fresh id, relying on the unique index to reject collisions."""
+    for attempt in range(attempts):
+        document.pop("_id", None)
+        document[field] = new_link_id()
+        try:
+            collection.insert_one(document)
+            return document[field]
+        except DuplicateKeyError:
+            if attempt == attempts - 1:
+                raise
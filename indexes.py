@@ -0,0 +1,75 @@
+import logging
+
+from pymongo import ASCENDING
+
+# Indexes older versions created that must not stay: a TTL index on users deleted whole user documents.
+OBSOLETE_INDEXES = [("users", "unverified_token_ttl")]
+
+
+def ensure_indexes(db):
+    """Create the indexes the queries rely on; returns False if any of them could not be set up."""
+    ok = True
+    for collection, name in OBSOLETE_INDEXES:
+        try:
+            if name in db[collection].index_information():
+                db[collection].drop_index(name)
+                logging.info(f"Dropped obsolete index {name} on {collection}.")
+        except Exception as e:
+            ok = False
+            logging.error(f"Failed to drop index {name} on {collection}: {e}")
+    specs = [
+        ("users", [("chat_id", ASCENDING)], {"unique": True, "name": "chat_id_unique"}),
+        ("users", [("unique_id", ASCENDING)], {"unique": True, "name": "unique_id_unique",
+                                                "partialFilterExpression": {"unique_id": {"$type": "string"}}}),
+        ("users", [("token_expires_at", ASCENDING)], {"sparse": True, "name": "token_expires_at_sparse"}),
+        ("file_storage", [("unique_id", ASCENDING)], {"unique": True, "name": "unique_id_unique"}),
+        ("file_storage", [("media_group_id", ASCENDING)], {"unique": True, "name": "media_group_id_unique",
+                                                           "partialFilterExpression": {"media_group_id": {"$type": "string"}}}),
+        ("file_storage", [("expires_at", ASCENDING)], {"sparse": True, "name": "expires_at_sparse"}),
+        ("file_storage", [("max_uses", ASCENDING)], {"sparse": True, "name": "max_uses_sparse"}),
+        ("file_storage_archive", [("unique_id", ASCENDING)], {"name": "unique_id"}),
+        ("shared_state", [("expire_at", ASCENDING)], {"expireAfterSeconds": 0, "name": "expire_at_1"}),
+        ("events", [("event", ASCENDING), ("at", ASCENDING)], {"name": "event_at"}),
+    ]
+    for collection, keys, options in specs:
+        try:
+            existing = db[collection].index_information()
+            if options["name"] in existing:
+                continue
+            db[collection].create_index(keys, **options)
+            logging.info(f"Created index {options['name']} on {collection}.")
+        except Exception as e:
+            ok = False
+            logging.error(f"Failed to create index {options['name']} on {collection}: {e}")
+    return ok
+
+
+def _stages(plan):
+    yield plan.get("stage")
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            yield from _stages(child)
+
+
+def hot_queries():
+    """The filters and projections the request handlers send on every hit, built with the same helpers."""
+    # core reads config, which migrate.py (an ensure_indexes caller) does not need.
+    import core
+    return [
+        ("users", {"chat_id": 0}, core.SUBSCRIPTION_PROJECTION),
+        ("users", core.unverified_token(""), core.ID_PROJECTION),
+        ("users", core.verification_update("")[1], core.VERIFY_PROJECTION),
+        ("file_storage", {"unique_id": ""}, core.FILE_PROJECTION),
+        ("file_storage", core.use_link("")[0], core.ID_PROJECTION),
+    ]
+
+
+def check_query_plans(db):
+    """Log a warning for every hot query whose plan scans the whole collection."""
+    for collection, query, projection in hot_queries():
+        try:
+            plan = db[collection].find(query, projection).explain()["queryPlanner"]["winningPlan"]
+            if "COLLSCAN" in _stages(plan):
+                logging.warning(f"Hot query on {collection} {list(query)} runs a COLLSCAN; check its index.")
+        except Exception as e:
+            logging.error(f"Failed to explain query on {collection} {list(query)}: {e}")
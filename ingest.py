@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+from collections import OrderedDict
+
+
+def update_chat_id(update):
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    return 0
+
+
+class UpdateIngestor:
+    """Bounded queue + worker pool between the webhook route and the bot handlers.
+
+    Updates are sharded by chat id so each chat is always served by the same
+    worker, which keeps per-chat ordering while different chats run in
+    parallel. Recently seen ``update_id``s are remembered so Telegram's
+    redeliveries are dropped instead of being handled twice; with a shared
+    ``store`` this also holds across workers and hosts.
+    """
+
+    def __init__(self, handler, workers=4, max_queue=1000, put_timeout=0.5, dedup_size=10000, store=None, dedup_ttl=3600):
+        self.handler = handler
+        self.put_timeout = put_timeout
+        self.dedup_size = dedup_size
+        self.store = store
+        self.dedup_ttl = dedup_ttl
+        per_worker = max(1, max_queue // max(1, workers))
+        self._queues = [queue.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        for i, q in enumerate(self._queues):
+            threading.Thread(target=self._run, args=(q,), name=f"ingest-worker-{i}", daemon=True).start()
+
+    def _remember(self, update_id):
+        with self._lock:
+            if update_id in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen[update_id] = True
+            if len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+        if self.store is None:
+            return True
+        try:
+            if self.store.add_if_absent(f"update:{update_id}", self.dedup_ttl):
+                return True
+        except Exception as e:
+            logging.error(f"Shared dedup store failed for update {update_id}, accepting it: {e}")
+            return True
+        with self._lock:
+            self.duplicates += 1
+        return False
+
+    def _forget(self, update_id):
+        with self._lock:
+            self._seen.pop(update_id, None)
+        if self.store is not None:
+            try:
+                self.store.discard(f"update:{update_id}")
+            except Exception as e:
+                logging.error(f"Failed to release update {update_id} in shared dedup store: {e}")
+
+    def submit(self, update):
+        """Queue an update. Returns False when the queue stays full (caller should ask Telegram to retry)."""
+        if not self._remember(update.update_id):
+            return True
+        q = self._queues[update_chat_id(update) % len(self._queues)]
+        try:
+            q.put(update, timeout=self.put_timeout)
+        except queue.Full:
+            self._forget(update.update_id)
+            self.rejected += 1
+            logging.warning(f"Update queue full, rejecting update {update.update_id}")
+            return False
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self.depth())
+        return True
+
+    def _run(self, q):
+        while True:
+            update = q.get()
+            try:
+                self.handler(update)
+                self.processed += 1
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Failed to process update {update.update_id}: {e}")
+            finally:
+                q.task_done()
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        return {"depth": self.depth(), "max_depth": self.max_depth, "workers": len(self._queues),
+                "accepted": self.accepted, "duplicates": self.duplicates, "rejected": self.rejected,
+                "processed": self.processed, "errors": self.errors}
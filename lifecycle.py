@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+
+from pymongo.errors import BulkWriteError
+
+import core
+
+
+class Sweeper:
+    """Runs a subclass's ``sweep()`` every ``interval`` seconds on a daemon thread (0 disables it).
+
+    With a shared ``lock`` store only one worker sweeps per interval; every
+    worker then calls ``count()`` to refresh the numbers in its own stats.
+    """
+
+    name = "sweeper"
+    # Key of the shared lock; one sweep per interval across workers.
+    lock_key = None
+
+    def __init__(self, interval=300, lock=None):
+        self.interval = interval
+        self.lock = lock
+        self._thread = None
+        self.last_sweep = None
+        self.last_sweep_seconds = None
+        self.errors = 0
+
+    def start(self):
+        if self._thread or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if self.lock is None or self.lock.add_if_absent(f"sweep:{self.lock_key}", self.interval):
+                    started = time.monotonic()
+                    self.sweep()
+                    self.last_sweep = time.time()
+                    self.last_sweep_seconds = round(time.monotonic() - started, 3)
+                # Every worker refreshes its own stats, whichever one swept.
+                self.count()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"{self.name} failed: {e}")
+            time.sleep(self.interval)
+
+    def stats(self):
+        return {"last_sweep": self.last_sweep, "last_sweep_seconds": self.last_sweep_seconds, "errors": self.errors}
+
+
+class LinkSweeper(Sweeper):
+    """Archives (or purges) expired and used-up links from file_storage in batches.
+
+    Archived links are copied to ``archive`` before being deleted, so a sweep
+    that dies half way repeats harmlessly.
+    """
+
+    name = "link-sweeper"
+    lock_key = "file_storage"
+
+    def __init__(self, collection, archive, mode="archive", batch_size=500, interval=300, lock=None):
+        super().__init__(interval=interval, lock=lock)
+        self.collection = collection
+        self.archive = archive
+        self.mode = mode
+        self.batch_size = batch_size
+        self.active = None
+        self.expired = None
+        self.archived = 0
+        self.purged = 0
+
+    def sweep(self):
+        started = time.monotonic()
+        swept = 0
+        while True:
+            batch = list(self.collection.find(core.expired_links()).limit(self.batch_size))
+            if not batch:
+                break
+            if self.mode == "archive":
+                try:
+                    self.archive.insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    # Documents an interrupted sweep already archived are duplicates here.
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+            deleted = self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}}).deleted_count
+            swept += deleted
+            if self.mode == "archive":
+                self.archived += deleted
+            else:
+                self.purged += deleted
+            if len(batch) < self.batch_size:
+                break
+        if swept:
+            logging.info(f"Swept {swept} expired links ({self.mode}) in {round(time.monotonic() - started, 3)}s.")
+        return swept
+
+    def count(self):
+        # Expired links are counted through the sparse expiry and use indexes; the rest are active.
+        self.expired = self.collection.count_documents(core.expired_links())
+        self.active = max(self.collection.estimated_document_count() - self.expired, 0)
+
+    def stats(self):
+        return {"mode": self.mode, "active": self.active, "expired": self.expired, "archived": self.archived,
+                "purged": self.purged, **super().stats()}
+
+
+class TokenSweeper(Sweeper):
+    """Clears expired verification tokens from ``users``, keeping the documents themselves.
+
+    A TTL index would delete the whole user, taking the broadcast audience and
+    the ``blocked`` flag with it.
+    """
+
+    name = "token-sweeper"
+    lock_key = "users"
+
+    def __init__(self, users, interval=60, lock=None):
+        super().__init__(interval=interval, lock=lock)
+        self.users = users
+        self.expired = 0
+        self.pending = None
+
+    def sweep(self):
+        query, update = core.expired_tokens()
+        cleared = self.users.update_many(query, update).modified_count
+        self.expired += cleared
+        if cleared:
+            logging.info(f"Cleared {cleared} expired verification tokens.")
+        return cleared
+
+    def count(self):
+        # Every issued, unverified token carries token_expires_at, which has a sparse index.
+        self.pending = self.users.count_documents({"token_expires_at": {"$exists": True}})
+
+    def stats(self):
+        return {"pending": self.pending, "expired": self.expired, **super().stats()}
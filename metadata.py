@@ -0,0 +1,104 @@
+import asyncio
+import inspect
+import logging
+import threading
+import time
+
+from telebot import types
+
+
+class BotMetadata:
+    """Bot identity and force-join channel info, loaded once and refreshed in the background.
+
+    ``get_me`` and ``get_chat(channel_id)`` almost never change, so handlers
+    read them (and the force-join keyboard built from them) from memory.
+    A lookup before the first successful load falls back to a direct call;
+    with an AsyncTeleBot that call must be awaited, so use ``ensure`` first.
+    Failed loads are retried every ``retry_interval`` seconds.
+    """
+
+    def __init__(self, bot, channel_id, refresh_interval=3600, retry_interval=60):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.refresh_interval = refresh_interval
+        self.retry_interval = min(retry_interval, refresh_interval)
+        self.is_async = inspect.iscoroutinefunction(bot.get_me)
+        self._lock = threading.Lock()
+        self._me = None
+        self._channel = None
+        self._join_markup = None
+        self.loaded_at = None
+        self.refresh_errors = 0
+
+    def load(self):
+        self._update(self.bot.get_me(), self.bot.get_chat(self.channel_id) if self.channel_id else None)
+
+    async def load_async(self):
+        """``load`` for an AsyncTeleBot; call it before serving, since properties cannot await."""
+        self._update(await self.bot.get_me(), await self.bot.get_chat(self.channel_id) if self.channel_id else None)
+
+    def _update(self, me, channel):
+        join_markup = None
+        if channel is not None:
+            join_markup = types.InlineKeyboardMarkup(
+                [[types.InlineKeyboardButton("Join Channel", url=f"https://t.me/{channel.username}")]])
+        with self._lock:
+            self._me, self._channel, self._join_markup = me, channel, join_markup
+            self.loaded_at = time.time()
+        logging.info(f"Loaded bot metadata for @{me.username}.")
+
+    def _failed(self, e):
+        self.refresh_errors += 1
+        logging.error(f"Failed to refresh bot metadata: {e}")
+        return self.retry_interval
+
+    def start(self, initial_delay=0):
+        """Refresh in the background; pass ``initial_delay`` when ``load`` has just been called."""
+        def refresh():
+            time.sleep(initial_delay)
+            while True:
+                try:
+                    self.load()
+                    delay = self.refresh_interval
+                except Exception as e:
+                    delay = self._failed(e)
+                time.sleep(delay)
+        threading.Thread(target=refresh, name="bot-metadata", daemon=True).start()
+
+    async def run_async(self, initial_delay=0):
+        """``start`` for an AsyncTeleBot; run it as a task on the server's loop."""
+        await asyncio.sleep(initial_delay)
+        while True:
+            try:
+                await self.load_async()
+                delay = self.refresh_interval
+            except Exception as e:
+                delay = self._failed(e)
+            await asyncio.sleep(delay)
+
+    async def ensure(self):
+        """Load now if no load has succeeded yet; works with both TeleBot and AsyncTeleBot."""
+        if self._me is None:
+            if self.is_async:
+                await self.load_async()
+            else:
+                self.load()
+
+    def _ensure(self):
+        if self._me is None:
+            if self.is_async:
+                raise RuntimeError("Bot metadata is not loaded; await ensure() before reading it")
+            self.load()
+
+    @property
+    def username(self):
+        self._ensure()
+        return self._me.username
+
+    @property
+    def join_markup(self):
+        self._ensure()
+        return self._join_markup
+
+    def stats(self):
+        return {"loaded_at": self.loaded_at, "refresh_errors": self.refresh_errors}
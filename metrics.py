@@ -0,0 +1,253 @@
+import bisect
+import functools
+import inspect
+import logging
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+
+from pymongo import monitoring
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_labels(labelnames, values)} {self.value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _child = _CounterChild
+
+    def inc(self, *values, amount=1):
+        self.labels(*values).inc(amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket = 'le="' + le + '"'
+            lines.append(f"{name}_bucket{_labels(labelnames, values, bucket)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labelnames, values)} {total}")
+        lines.append(f"{name}_count{_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, seconds, *values):
+        self.labels(*values).observe(seconds)
+
+    def time(self, *values):
+        """Decorator timing every call (sync or async) of the wrapped function under ``values``."""
+        child = self.labels(*values)
+
+        def decorator(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        child.observe(time.perf_counter() - started)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+
+class Gauge:
+    """A value read from ``fn`` when the metrics are scraped, so it costs nothing in between."""
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logging.debug(f"Gauge {self.name} unavailable: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn):
+        return self.register(Gauge(name, help, fn))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HANDLER_SECONDS = REGISTRY.register(Histogram("bot_handler_seconds", "Time spent in routes and bot handlers.", ["handler"]))
+DEPENDENCY_SECONDS = REGISTRY.register(Histogram("bot_dependency_seconds", "Time spent waiting on MongoDB and the Telegram Bot API.",
+                                                 ["dependency", "operation"]))
+EVENTS = REGISTRY.register(Counter("bot_events_total", "Subscriptions, verifications, file sends and other bot events.", ["event"]))
+ERRORS = REGISTRY.register(Counter("bot_errors_total", "Errors logged, by logger.", ["logger"]))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times every MongoDB command from the driver's own monitoring events; pass it in ``event_listeners``."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        DEPENDENCY_SECONDS.observe(event.duration_micros / 1e6, "mongo", event.command_name)
+
+    def failed(self, event):
+        DEPENDENCY_SECONDS.observe(event.duration_micros / 1e6, "mongo", event.command_name)
+        EVENTS.inc("mongo_failure")
+
+
+class _ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record):
+        ERRORS.inc(record.name)
+
+
+def count_logged_errors():
+    """Count every ERROR log record in ``bot_errors_total``; call after logging is configured."""
+    root = logging.getLogger()
+    if not any(isinstance(handler, _ErrorCounter) for handler in root.handlers):
+        root.addHandler(_ErrorCounter())
+
+
+class SamplingProfiler:
+    """Samples every thread's stack each ``interval`` seconds and keeps collapsed stack counts.
+
+    The output of ``collapsed()`` is the "folded" format flame graph tools read.
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = _Tally()
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def _run(self, stop):
+        own = threading.get_ident()
+        while not stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(f"{frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self.samples.update(stacks)
+
+    @property
+    def running(self):
+        return self._stop is not None
+
+    def start(self):
+        if self._stop is None:
+            self._stop = threading.Event()
+            threading.Thread(target=self._run, args=(self._stop,), name="sampling-profiler", daemon=True).start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def collapsed(self, reset=False):
+        with self._lock:
+            samples = self.samples.most_common()
+            if reset:
+                self.samples = _Tally()
+        return "\n".join(f"{stack} {count}" for stack, count in samples) + "\n"
@@ -0,0 +1,195 @@
+"""Stream file_storage and users out of one cluster and into another.
+
+Export walks each collection in _id order with a batched cursor and writes
+gzip-compressed Extended JSON lines, split into parts of --part-size
+documents. Import loads the parts with parallel unordered insert_many calls
+and recreates the indexes afterwards. Both record a checkpoint after every
+part, so an interrupted run continues where it stopped, and re-running an
+export later only picks up documents added since.
+
+    python migrate.py export --uri "$SOURCE_URI" --dir backup/
+    python migrate.py import --uri "$TARGET_URI" --dir backup/ --workers 8
+"""
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import certifi
+from bson import json_util
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from pymongo.server_api import ServerApi
+
+from indexes import ensure_indexes
+
+COLLECTIONS = ["file_storage", "users"]
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+logging.basicConfig(level=logging.INFO)
+
+
+def connect(uri, database):
+    tls = {"tlsCAFile": certifi.where()} if uri.startswith("mongodb+srv://") else {}
+    return MongoClient(uri, server_api=ServerApi('1'), **tls)[database]
+
+
+def load_checkpoint(path, default):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json_util.loads(f.read(), json_options=JSON_OPTIONS)
+    return default
+
+
+def save_checkpoint(path, checkpoint):
+    # Write then rename, so a crash never leaves a half-written checkpoint.
+    with open(path + ".tmp", "w") as f:
+        f.write(json_util.dumps(checkpoint, json_options=JSON_OPTIONS))
+    os.replace(path + ".tmp", path)
+
+
+class Progress:
+    """Counts documents and bytes for one collection and logs the rate every ``interval`` seconds."""
+
+    def __init__(self, name, interval=5):
+        self.name = name
+        self.interval = interval
+        self.documents = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        self._logged = self.started
+        self._lock = threading.Lock()
+
+    def add(self, documents, size, skipped=0):
+        with self._lock:
+            self.documents += documents
+            self.bytes += size
+            self.skipped += skipped
+            now = time.monotonic()
+            if now - self._logged >= self.interval:
+                self._logged = now
+                logging.info(f"{self.name}: {self.documents} documents, {self.documents / (now - self.started):.0f} docs/s")
+
+    def report(self):
+        seconds = time.monotonic() - self.started
+        return {"documents": self.documents, "skipped_duplicates": self.skipped, "bytes": self.bytes,
+                "seconds": round(seconds, 2),
+                "docs_per_second": round(self.documents / seconds, 1) if seconds else None,
+                "mb_per_second": round(self.bytes / seconds / 1e6, 2) if seconds else None}
+
+
+def export_collection(db, name, directory, batch_size, part_size):
+    checkpoint_path = os.path.join(directory, f"{name}.export.json")
+    checkpoint = load_checkpoint(checkpoint_path, {"last_id": None, "parts": 0, "documents": 0})
+    query = {"_id": {"$gt": checkpoint["last_id"]}} if checkpoint["last_id"] is not None else {}
+    progress = Progress(f"export {name}")
+    cursor = db[name].find(query).sort("_id", 1).batch_size(batch_size)
+    part, count, last_id = None, 0, None
+    try:
+        for document in cursor:
+            if part is None:
+                part_path = os.path.join(directory, f"{name}.{checkpoint['parts']:06d}.jsonl.gz")
+                part = gzip.open(part_path, "wt", compresslevel=6)
+            line = json_util.dumps(document, json_options=JSON_OPTIONS) + "\n"
+            part.write(line)
+            count += 1
+            last_id = document["_id"]
+            progress.add(1, len(line))
+            if count == part_size:
+                part.close()
+                part = None
+                checkpoint.update(last_id=last_id, parts=checkpoint["parts"] + 1, documents=checkpoint["documents"] + count)
+                save_checkpoint(checkpoint_path, checkpoint)
+                count = 0
+        if part is not None:
+            part.close()
+            checkpoint.update(last_id=last_id, parts=checkpoint["parts"] + 1, documents=checkpoint["documents"] + count)
+            save_checkpoint(checkpoint_path, checkpoint)
+    finally:
+        cursor.close()
+    return {**progress.report(), "parts": checkpoint["parts"], "total_documents": checkpoint["documents"]}
+
+
+def import_part(collection, path, batch_size, progress):
+    def insert(batch, size):
+        try:
+            collection.insert_many(batch, ordered=False)
+            progress.add(len(batch), size)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            other = [error for error in errors if error.get("code") != 11000]
+            if other:
+                raise
+            # Duplicates are documents a previous, interrupted run already inserted.
+            progress.add(len(batch) - len(errors), size, skipped=len(errors))
+
+    batch, size = [], 0
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            batch.append(json_util.loads(line, json_options=JSON_OPTIONS))
+            size += len(line)
+            if len(batch) == batch_size:
+                insert(batch, size)
+                batch, size = [], 0
+    if batch:
+        insert(batch, size)
+
+
+def import_collection(db, name, directory, batch_size, workers):
+    checkpoint_path = os.path.join(directory, f"{name}.import.json")
+    checkpoint = load_checkpoint(checkpoint_path, {"done": []})
+    done = set(checkpoint["done"])
+    parts = [path for path in sorted(glob.glob(os.path.join(directory, f"{name}.*.jsonl.gz")))
+             if os.path.basename(path) not in done]
+    progress = Progress(f"import {name}")
+    lock = threading.Lock()
+
+    def run(path):
+        import_part(db[name], path, batch_size, progress)
+        with lock:
+            done.add(os.path.basename(path))
+            save_checkpoint(checkpoint_path, {"done": sorted(done)})
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(run, path) for path in parts]:
+            future.result()
+    return {**progress.report(), "parts": len(parts), "parts_already_done": len(checkpoint["done"])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI"))
+    parser.add_argument("--db", default="media_shortener")
+    parser.add_argument("--dir", required=True)
+    parser.add_argument("--collections", nargs="+", default=COLLECTIONS, choices=COLLECTIONS)
+    parser.add_argument("--batch-size", type=int, default=5000, help="cursor batch (export) or insert_many size (import)")
+    parser.add_argument("--part-size", type=int, default=200000, help="documents per exported part")
+    parser.add_argument("--workers", type=int, default=4, help="parts imported in parallel")
+    parser.add_argument("--skip-indexes", action="store_true", help="do not create indexes after import")
+    args = parser.parse_args()
+    if not args.uri:
+        parser.error("--uri or MONGO_URI is required")
+
+    os.makedirs(args.dir, exist_ok=True)
+    db = connect(args.uri, args.db)
+    report = {}
+    for name in args.collections:
+        if args.command == "export":
+            report[name] = export_collection(db, name, args.dir, args.batch_size, args.part_size)
+        else:
+            report[name] = import_collection(db, name, args.dir, args.batch_size, args.workers)
+        logging.info(f"{args.command} {name}: {report[name]}")
+    if args.command == "import" and not args.skip_indexes:
+        ensure_indexes(db)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
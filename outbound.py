@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from metrics import DEPENDENCY_SECONDS
+
+USER = 0
+BACKGROUND = 1
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now):
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class SharedBudget:
+    """Telegram's global rate shared by every worker, counted per second in a store (see store.py).
+
+    Background calls may only use ``background_share`` of each second, so a
+    broadcast on one worker can take the budget the others leave idle without
+    starving user-facing calls. Store errors fail open.
+    """
+
+    def __init__(self, store, rate, background_share=0.8):
+        self.store = store
+        self.rate = rate
+        self.background_share = background_share
+        self.denied = 0
+        self.errors = 0
+
+    def wait_time(self, priority):
+        """Take one call from the current second and return 0, or return how long to wait."""
+        now = time.time()
+        key = f"rate:telegram:{int(now)}"
+        limit = self.rate if priority == USER else self.rate * self.background_share
+        try:
+            if self.store.incr(key, 2) <= limit:
+                return 0.0
+            # Give the slot back so denied attempts do not eat into the budget.
+            self.store.incr(key, 2, -1)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Shared Telegram rate budget unavailable, sending anyway: {e}")
+            return 0.0
+        self.denied += 1
+        return int(now) + 1 - now
+
+    def stats(self):
+        return {"rate": self.rate, "background_share": self.background_share, "denied": self.denied, "errors": self.errors}
+
+
+class OutboundDispatcher:
+    """Central gate for Bot API calls that honours Telegram's global and per-chat limits.
+
+    Callers block in their own thread until both the global bucket and the
+    chat's bucket have a token. Background callers (e.g. scheduled deletes)
+    step aside while any user-facing call is waiting. A 429 pauses the
+    affected bucket for ``retry_after`` seconds and the call is retried.
+    With a ``shared`` budget every call also takes a slot of the global
+    rate shared by all workers.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3, max_chats=10000, shared=None):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.shared = shared
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = {}
+        self._cond = threading.Condition()
+        self._user_waiting = 0
+        self._recent = deque()
+        self.sent = 0
+        self.throttled = 0
+        self.retries_429 = 0
+        self.failures = 0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items()
+                               if b.wait_time(now) > 0 or b.tokens < b.capacity}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _reserve(self, chat_id, priority):
+        """Take a token and return 0, or return how long to wait. Caller holds the lock."""
+        if priority != USER and self._user_waiting:
+            return 0.05
+        now = time.monotonic()
+        wait = self.global_bucket.wait_time(now)
+        if chat_id is not None:
+            wait = max(wait, self._chat_bucket(chat_id).wait_time(now))
+        if wait <= 0:
+            self.global_bucket.take()
+            if chat_id is not None:
+                self._chat_bucket(chat_id).take()
+        return wait
+
+    def _enter(self, priority):
+        with self._cond:
+            if priority == USER:
+                self._user_waiting += 1
+
+    def _leave(self, priority, throttled):
+        with self._cond:
+            if throttled:
+                self.throttled += 1
+            if priority == USER:
+                self._user_waiting -= 1
+                self._cond.notify_all()
+
+    def _acquire(self, chat_id, priority):
+        self._enter(priority)
+        throttled = False
+        try:
+            while True:
+                with self._cond:
+                    while True:
+                        wait = self._reserve(chat_id, priority)
+                        if wait <= 0:
+                            break
+                        throttled = True
+                        self._cond.wait(wait)
+                # The shared budget is a store round trip, so it is checked outside the lock.
+                wait = self.shared.wait_time(priority) if self.shared else 0.0
+                if wait <= 0:
+                    break
+                throttled = True
+                time.sleep(wait)
+        finally:
+            self._leave(priority, throttled)
+
+    async def _acquire_async(self, chat_id, priority):
+        self._enter(priority)
+        throttled = False
+        try:
+            while True:
+                with self._cond:
+                    wait = self._reserve(chat_id, priority)
+                if wait <= 0 and self.shared:
+                    wait = await asyncio.to_thread(self.shared.wait_time, priority)
+                if wait <= 0:
+                    break
+                throttled = True
+                await asyncio.sleep(wait)
+        finally:
+            self._leave(priority, throttled)
+
+    def _pause(self, chat_id, retry_after):
+        with self._cond:
+            bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+            bucket.paused_until = max(bucket.paused_until, time.monotonic() + retry_after)
+
+    def _retry_after(self, chat_id, error, attempt):
+        """Seconds to back off for a retryable 429, or None to give up and re-raise."""
+        if getattr(error, "error_code", None) != 429 or attempt == self.max_retries:
+            self.failures += 1
+            return None
+        retry_after = (getattr(error, "result_json", None) or {}).get("parameters", {}).get("retry_after", 1)
+        self.retries_429 += 1
+        logging.warning(f"Telegram 429 for chat {chat_id}, retrying after {retry_after}s")
+        self._pause(chat_id, retry_after)
+        return retry_after
+
+    def call(self, chat_id, fn, *args, priority=USER, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._acquire(chat_id, priority)
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if self._retry_after(chat_id, e, attempt) is None:
+                    raise
+                continue
+            finally:
+                DEPENDENCY_SECONDS.observe(time.perf_counter() - started, "telegram", getattr(fn, "__name__", "call"))
+            self._record_sent()
+            return result
+
+    async def call_async(self, chat_id, fn, *args, priority=USER, **kwargs):
+        """``call`` for coroutine functions such as AsyncTeleBot methods; waits without blocking the loop."""
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_async(chat_id, priority)
+            started = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                if self._retry_after(chat_id, e, attempt) is None:
+                    raise
+                continue
+            finally:
+                DEPENDENCY_SECONDS.observe(time.perf_counter() - started, "telegram", getattr(fn, "__name__", "call"))
+            self._record_sent()
+            return result
+
+    def _record_sent(self):
+        now = time.monotonic()
+        with self._cond:
+            self.sent += 1
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - 10:
+                self._recent.popleft()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            while self._recent and self._recent[0] < now - 10:
+                self._recent.popleft()
+            per_second = len(self._recent) / 10
+        return {"sent": self.sent, "per_second": per_second, "throttled": self.throttled,
+                "retries_429": self.retries_429, "failures": self.failures, "tracked_chats": len(self._chats),
+                "shared": self.shared.stats() if self.shared else None}
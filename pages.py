@@ -0,0 +1,66 @@
+import gzip
+import hashlib
+import os
+import threading
+
+import jinja2
+from markupsafe import escape
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+MARKER = "__UNIQUE_ID__"
+
+# The first two pages only depend on the token in the URL, so shared caches may keep them;
+# the last one depends on the token still being valid and must be revalidated.
+CACHE_CONTROL = {
+    "verify.html": "public, max-age=3600",
+    "verify_continue.html": "public, max-age=3600",
+    "complete_subscription.html": "private, no-cache",
+}
+
+
+class PageRenderer:
+    """Verification pages compiled once at startup and served as bytes.
+
+    Each template is rendered a single time with a marker in place of the
+    token and split around it, so a hit is just a join. Responses carry a
+    strong ETag (template hash + token), ``Cache-Control`` from
+    ``CACHE_CONTROL``, and are gzipped when the client accepts it.
+    """
+
+    def __init__(self, constants=None, template_dir=TEMPLATE_DIR, min_gzip_size=256):
+        self.min_gzip_size = min_gzip_size
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir), autoescape=True)
+        self._pages = {}
+        for name in CACHE_CONTROL:
+            html = env.get_template(name).render(unique_id=MARKER, **(constants or {}))
+            version = hashlib.sha1(html.encode()).hexdigest()[:12]
+            self._pages[name] = (html.split(MARKER), version)
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.not_modified = 0
+        self.gzipped = 0
+
+    def render(self, name, unique_id, accept_encoding="", if_none_match=""):
+        """Returns ``(status, body, headers)`` for ``name`` filled in with ``unique_id``."""
+        parts, version = self._pages[name]
+        compress = "gzip" in (accept_encoding or "")
+        etag = f'"{version}-{unique_id}{"-gz" if compress else ""}"'
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL[name], "Vary": "Accept-Encoding"}
+        if if_none_match and etag in if_none_match:
+            with self._lock:
+                self.not_modified += 1
+            return 304, b"", headers
+        body = str(escape(unique_id)).join(parts).encode()
+        headers["Content-Type"] = "text/html; charset=utf-8"
+        if compress and len(body) >= self.min_gzip_size:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+            with self._lock:
+                self.gzipped += 1
+        with self._lock:
+            self.rendered += 1
+        return 200, body, headers
+
+    def stats(self):
+        return {"rendered": self.rendered, "not_modified": self.not_modified, "gzipped": self.gzipped,
+                "versions": {name: version for name, (_, version) in self._pages.items()}}
@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class SlidingWindowLimiter:
+    """Allows ``limit`` hits per key in any ``window`` seconds, approximated from two fixed windows.
+
+    The count for the previous window is weighted by how much of it still
+    overlaps the sliding window, so only two integers are kept per key.
+    With a shared ``store`` (see store.py), hits that pass the local check
+    are also counted across workers in fixed windows; store errors fail open.
+    A ``limit`` of 0 or less allows everything.
+    """
+
+    def __init__(self, name, limit, window, store=None, maxsize=100000):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.store = store
+        self.maxsize = maxsize
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.shed = 0
+
+    def _local(self, key, now):
+        index, offset = divmod(now, self.window)
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None or entry[0] < index - 1:
+                entry = [index, 0, 0]
+            elif entry[0] == index - 1:
+                entry = [index, entry[2], 0]
+            self._counts[key] = entry
+            self._counts.move_to_end(key)
+            if len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+            if entry[1] * (1 - offset / self.window) + entry[2] >= self.limit:
+                return False
+            entry[2] += 1
+            return True
+
+    def _shared(self, key, now):
+        index = int(now // self.window)
+        try:
+            return self.store.incr(f"ratelimit:{self.name}:{key}:{index}", self.window * 2) <= self.limit
+        except Exception as e:
+            logging.error(f"Shared rate limit store failed for {self.name}, allowing: {e}")
+            return True
+
+    def allow(self, key):
+        if self.limit <= 0:
+            return True
+        now = time.time()
+        allowed = self._local(key, now) and (self.store is None or self._shared(key, now))
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.shed += 1
+        return allowed
+
+    def stats(self):
+        with self._lock:
+            keys = len(self._counts)
+        return {"limit": self.limit, "window": self.window, "shared": self.store is not None,
+                "keys": keys, "allowed": self.allowed, "shed": self.shed}
+
+
+def client_ip(remote_addr, forwarded_for, trusted_hops=0):
+    """The client address, taking the entry ``trusted_hops`` from the end of X-Forwarded-For behind proxies."""
+    if trusted_hops and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",")]
+        if len(hops) >= trusted_hops:
+            return hops[-trusted_hops]
+    return remote_addr or "unknown"
@@ -0,0 +1,155 @@
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class DeletionScheduler:
+    """Single-threaded, MongoDB-backed replacement for one threading.Timer per sent message.
+
+    Jobs live in a min-heap ordered by due time and are mirrored to the
+    ``scheduled_deletions`` collection so they survive restarts. Documents
+    carry an ``expire_at`` TTL field so jobs that can never run (e.g. the
+    process was down for longer than Telegram allows deletes) are purged
+    by MongoDB itself.
+
+    Several workers can share the collection: a batch is claimed with
+    ``claimed_by`` before it runs, so each message is deleted once, and
+    overdue jobs left behind by a dead worker are adopted periodically.
+    """
+
+    def __init__(self, delete_message, collection, batch_size=50, ttl_grace=timedelta(hours=48), adopt_after=120):
+        self.delete_message = delete_message
+        self.collection = collection
+        self.batch_size = batch_size
+        self.ttl_grace = ttl_grace
+        self.adopt_after = adopt_after
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._heap = []
+        self._queued = set()
+        self._unpersisted = set()
+        self._next_adopt = 0.0
+        self._cond = threading.Condition()
+        self._thread = None
+        self.deleted = 0
+        self.failed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        if self._thread:
+            return
+        try:
+            self.collection.create_index("expire_at", expireAfterSeconds=0)
+        except Exception as e:
+            logging.error(f"Failed to create TTL index on scheduled_deletions: {e}")
+        self._restore({"claimed_by": None})
+        self._next_adopt = time.time() + self.adopt_after
+        self._thread = threading.Thread(target=self._run, name="deletion-scheduler", daemon=True)
+        self._thread.start()
+
+    def _restore(self, query=None):
+        try:
+            restored = 0
+            for job in self.collection.find(query or {}, {"chat_id": 1, "message_id": 1, "run_at": 1}):
+                restored += self._push(job["run_at"], job["chat_id"], job["message_id"])
+            if restored:
+                logging.info(f"Restored {restored} pending deletions from MongoDB.")
+        except Exception as e:
+            logging.error(f"Failed to restore pending deletions: {e}")
+
+    def _adopt(self):
+        # Jobs scheduled by a worker that has since died are only in MongoDB.
+        self._next_adopt = time.time() + self.adopt_after
+        self._restore({"run_at": {"$lt": time.time() - self.adopt_after}, "claimed_by": None})
+
+    def _push(self, run_at, chat_id, message_id):
+        with self._cond:
+            if (chat_id, message_id) in self._queued:
+                return 0
+            self._queued.add((chat_id, message_id))
+            heapq.heappush(self._heap, (run_at, chat_id, message_id))
+            self._cond.notify()
+            return 1
+
+    def schedule(self, chat_id, message_id, delay=1200):
+        run_at = time.time() + delay
+        try:
+            self.collection.update_one(
+                {"_id": f"{chat_id}:{message_id}"},
+                {"$set": {"chat_id": chat_id, "message_id": message_id, "run_at": run_at,
+                          "expire_at": datetime.utcnow() + timedelta(seconds=delay) + self.ttl_grace}},
+                upsert=True)
+        except Exception as e:
+            logging.error(f"Failed to persist deletion of message {message_id}: {e}")
+            with self._cond:
+                self._unpersisted.add(f"{chat_id}:{message_id}")
+        self._push(run_at, chat_id, message_id)
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                if now >= self._next_adopt:
+                    return []
+                wait = self._next_adopt - now
+                if self._heap:
+                    wait = min(wait, self._heap[0][0] - now)
+                self._cond.wait(wait)
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                job = heapq.heappop(self._heap)
+                self._queued.discard(job[1:])
+                batch.append(job)
+            return batch
+
+    def _claim(self, batch):
+        ids = [f"{chat_id}:{message_id}" for _, chat_id, message_id in batch]
+        with self._cond:
+            claimed = {job_id for job_id in ids if job_id in self._unpersisted}
+            self._unpersisted.difference_update(claimed)
+        try:
+            self.collection.update_many({"_id": {"$in": ids}, "claimed_by": None}, {"$set": {"claimed_by": self.instance_id}})
+            claimed.update(job["_id"] for job in self.collection.find({"_id": {"$in": ids}, "claimed_by": self.instance_id}, {"_id": 1}))
+        except Exception as e:
+            logging.error(f"Failed to claim {len(ids)} deletions, running them unclaimed: {e}")
+            return batch
+        return [job for job, job_id in zip(batch, ids) if job_id in claimed]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                self._adopt()
+                continue
+            now = time.time()
+            done = []
+            for run_at, chat_id, message_id in self._claim(batch):
+                self.last_lag = now - run_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+                try:
+                    self.delete_message(chat_id, message_id)
+                    self.deleted += 1
+                    logging.info(f"Message {message_id} deleted from chat {chat_id}")
+                except Exception as e:
+                    self.failed += 1
+                    logging.error(f"Failed to delete message {message_id}: {e}")
+                done.append(f"{chat_id}:{message_id}")
+            if not done:
+                continue
+            try:
+                self.collection.delete_many({"_id": {"$in": done}})
+            except Exception as e:
+                logging.error(f"Failed to clear {len(done)} finished deletions: {e}")
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._heap)
+            overdue = time.time() - self._heap[0][0] if self._heap else 0.0
+        return {"pending": pending, "overdue_seconds": max(overdue, 0.0), "last_lag_seconds": self.last_lag,
+                "max_lag_seconds": self.max_lag, "deleted": self.deleted, "failed": self.failed}
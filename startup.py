@@ -0,0 +1,71 @@
+import logging
+import threading
+import time
+
+
+class Lazy:
+    """Stands in for an object (a MongoClient, a collection) that is only built on first use.
+
+    Attribute access is forwarded to the object returned by ``factory``,
+    which is called once, from whichever thread gets there first. Item
+    access returns another ``Lazy``, so ``client["db"]["users"]`` does not
+    connect either.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, key):
+        return Lazy(lambda: self.resolve()[key])
+
+
+class Startup:
+    """Runs named startup phases in parallel background threads and records how long each took.
+
+    A phase fails when it raises or returns False (as ``ensure_indexes`` and
+    ``set_webhook_once`` do).
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.started_at = None
+        self._lock = threading.Lock()
+
+    def start(self, phases):
+        """Start every ``name: fn`` phase once; later calls are no-ops."""
+        with self._lock:
+            if self.started_at is not None:
+                return False
+            self.started_at = time.time()
+        for name, fn in phases.items():
+            self.phases[name] = {"state": "running", "seconds": None}
+            threading.Thread(target=self._run, args=(name, fn), name=f"startup-{name}", daemon=True).start()
+        return True
+
+    def _run(self, name, fn):
+        started = time.perf_counter()
+        try:
+            state = "failed" if fn() is False else "done"
+        except Exception as e:
+            state = "failed"
+            logging.error(f"Startup phase {name} failed: {e}")
+        seconds = time.perf_counter() - started
+        self.phases[name] = {"state": state, "seconds": round(seconds, 3)}
+        logging.info(f"Startup phase {name} {state} in {seconds:.3f}s.")
+
+    def stats(self):
+        phases = dict(self.phases)
+        return {"started_at": self.started_at, "ready": bool(phases) and all(p["state"] != "running" for p in phases.values()),
+                "phases": phases}
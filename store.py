@@ -0,0 +1,77 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class MemoryStore:
+    """In-process store; the default for a single worker and the fake used in tests."""
+
+    def __init__(self):
+        self._data = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add_if_absent(self, key, ttl):
+        """Claim ``key`` for ``ttl`` seconds. Returns False if it is already claimed."""
+        now = time.monotonic()
+        with self._lock:
+            if self._data.get(key, 0) > now:
+                return False
+            self._data[key] = now + ttl
+            if len(self._data) > 100000:
+                self._data = {k: expires for k, expires in self._data.items() if expires > now}
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._counts.pop(key, None)
+
+    def incr(self, key, ttl, amount=1):
+        """Add ``amount`` to the counter ``key`` (kept ``ttl`` seconds) and return its new value."""
+        now = time.monotonic()
+        with self._lock:
+            count, expires = self._counts.get(key, (0, 0))
+            live = expires > now
+            count = count + amount if live else amount
+            self._counts[key] = (count, expires if live else now + ttl)
+            if len(self._counts) > 100000:
+                self._counts = {k: entry for k, entry in self._counts.items() if entry[1] > now}
+            return count
+
+
+class MongoStore:
+    """Store shared by every worker and host, backed by a collection with a TTL index (see indexes.py)."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def add_if_absent(self, key, ttl):
+        now = datetime.utcnow()
+        expire_at = now + timedelta(seconds=ttl)
+        try:
+            self.collection.insert_one({"_id": key, "expire_at": expire_at})
+            return True
+        except DuplicateKeyError:
+            # The TTL monitor only runs once a minute, so an expired claim may still be present.
+            result = self.collection.update_one({"_id": key, "expire_at": {"$lte": now}}, {"$set": {"expire_at": expire_at}})
+            return result.modified_count == 1
+
+    def discard(self, key):
+        self.collection.delete_one({"_id": key})
+
+    def incr(self, key, ttl, amount=1):
+        update = {"$inc": {"count": amount}, "$setOnInsert": {"expire_at": datetime.utcnow() + timedelta(seconds=ttl)}}
+        try:
+            doc = self.collection.find_one_and_update({"_id": key}, update, upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # Two workers upserted the same new key at once; the retry finds the existing document.
+            doc = self.collection.find_one_and_update({"_id": key}, update, return_document=ReturnDocument.AFTER)
+        return doc["count"]
+
+
+def make_store(kind, db):
+    return MongoStore(db["shared_state"]) if kind == "mongo" else MemoryStore()
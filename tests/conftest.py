@@ -0,0 +1,26 @@
+import os
+import sys
+
+import mongomock
+import pytest
+
+# config.py reads the environment at import time, so it must be set before any module is imported.
+os.environ.update({"BOT_TOKEN": "123456:test", "MONGO_URI": "mongodb://localhost", "WEBHOOK_URL": "http://localhost",
+                   "WEBHOOK_URL2": "http://localhost", "CHANNEL_ID": "-100100", "OWNER_ID": "1",
+                   "PRIVATE_GROUP_ID": "-100200", "ADMINS": "2"})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["media_shortener"]
+
+
+def wait_for(predicate, timeout=5.0):
+    """Poll ``predicate`` until it is true, for the background threads under test."""
+    import time
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
@@ -0,0 +1,67 @@
+import socket
+import subprocess
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from broadcast import Broadcaster
+from conftest import wait_for
+
+
+def make_broadcaster(db, sent):
+    lock = threading.Lock()
+
+    def send(chat_id, from_chat_id, message_id):
+        with lock:
+            sent.append(chat_id)
+
+    return Broadcaster(db["users"], db["broadcasts"], send, workers=2, batch_size=2)
+
+
+def interrupted_job(db, owner, updated_at):
+    db["users"].insert_many([{"chat_id": chat_id} for chat_id in range(1, 6)])
+    last_id = db["users"].find_one({"chat_id": 2})["_id"]
+    db["broadcasts"].insert_one({"from_chat_id": 1, "message_id": 9, "state": "running", "owner": owner,
+                                 "last_id": last_id, "total": 5, "sent": 2, "failed": 0, "blocked": 0,
+                                 "started_at": updated_at, "updated_at": updated_at})
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_job_of_a_dead_process_on_this_host_resumes_at_once(db):
+    interrupted_job(db, f"{socket.gethostname()}:{dead_pid()}", datetime.utcnow())
+    sent = []
+    broadcaster = make_broadcaster(db, sent)
+    assert broadcaster.resume() is not None
+    wait_for(lambda: not broadcaster.running)
+    assert sorted(sent) == [3, 4, 5]
+    assert db["broadcasts"].find_one()["state"] == "done"
+
+
+def test_job_of_a_live_process_is_not_resumed(db):
+    interrupted_job(db, "other-host:1", datetime.utcnow())
+    broadcaster = make_broadcaster(db, [])
+    assert broadcaster.resume() is None
+    assert broadcaster.start(1, 10) is None
+
+
+def test_job_without_a_heartbeat_is_resumed(db):
+    interrupted_job(db, "other-host:1", datetime.utcnow() - timedelta(minutes=1))
+    sent = []
+    broadcaster = make_broadcaster(db, sent)
+    assert broadcaster.resume() is not None
+    wait_for(lambda: not broadcaster.running)
+    assert sorted(sent) == [3, 4, 5]
+
+
+def test_status_and_cancel_reach_a_broadcast_running_on_another_worker(db):
+    interrupted_job(db, "otherhost:1", datetime.utcnow())
+    broadcaster = make_broadcaster(db, [])
+    assert broadcaster.progress() is None
+    assert broadcaster.latest()["state"] == "running" and broadcaster.latest()["processed"] == 2
+    assert broadcaster.cancel()
+    assert broadcaster.latest()["state"] == "cancelled"
@@ -0,0 +1,92 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from caching import MISSING, LiveTokens, MembershipCache, SubscriptionCache, TTLCache
+
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache(maxsize=2, ttl=60, negative_ttl=0.05)
+    assert cache.get("a") is MISSING
+    cache.set("a", 1)
+    cache.set("none", None)
+    assert cache.get("a") == 1
+    assert cache.get("none") is None
+    time.sleep(0.06)
+    assert cache.get("none") is MISSING
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.get("a") is MISSING
+    assert cache.stats()["evictions"] == 1
+
+
+def test_membership_lookups_are_coalesced():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch(key):
+        calls.append(key)
+        started.set()
+        release.wait()
+        return True
+
+    cache = MembershipCache(fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(("g", 1)))) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [("g", 1)]
+    assert results == [True] * 5
+    assert cache.get(("g", 1)) is True
+
+
+def test_membership_serves_a_stale_answer_when_the_lookup_fails():
+    answers = [True]
+
+    def fetch(key):
+        if not answers:
+            raise ConnectionError("Telegram is down")
+        return answers.pop()
+
+    cache = MembershipCache(fetch, positive_ttl=0, stale_ttl=60)
+    assert cache.get(("g", 1)) is True
+    assert cache.get(("g", 1)) is True
+    assert cache.get(("g", 2)) is False
+    assert cache.stats()["stale_served"] == 1
+
+
+def test_subscriptions_are_cached_until_they_expire():
+    cache = SubscriptionCache(negative_ttl=0.05)
+    cache.update(1, datetime.utcnow() + timedelta(seconds=0.05))
+    cache.update(2, None)
+    cache.update(3, datetime.utcnow() - timedelta(seconds=1))
+    assert (cache.get(1), cache.get(2), cache.get(3)) == (True, False, False)
+    time.sleep(0.06)
+    # Expired entries go back to the database, which may know of a newer verification.
+    assert (cache.get(1), cache.get(2), cache.get(3)) == (MISSING, MISSING, MISSING)
+
+
+def test_unsubscribed_chats_are_not_cached_while_the_stream_is_down():
+    cache = SubscriptionCache()
+    cache.update(1, None)
+    assert cache.get(1) is False
+    cache._watcher = object()
+    cache.update(1, None)
+    assert cache.get(1) is MISSING
+    cache.update(2, datetime.utcnow() + timedelta(hours=1))
+    assert cache.get(2) is True
+
+
+def test_a_reissued_token_retires_the_previous_one():
+    tokens = LiveTokens()
+    tokens.issue(1, "old")
+    tokens.issue(1, "new")
+    tokens.issue(2, "other")
+    assert (tokens.get("old"), tokens.get("new"), tokens.get("other"), tokens.get("random")) == (None, True, True, MISSING)
@@ -0,0 +1,59 @@
+"""The shared handler flow under SyncIO, against the benchmark's fake Bot API and mongomock."""
+import threading
+
+import pytest
+import telebot
+
+import transport
+from benchmark import FakeBotAPI, message_update
+from handlers import Handlers, SyncIO, run_sync
+from outbound import OutboundDispatcher
+from store import MemoryStore
+
+
+@pytest.fixture
+def fake():
+    fake = FakeBotAPI()
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+    transport.install(transport.TelegramTransport(), fake.api_url)
+    yield fake
+    fake.shutdown()
+
+
+@pytest.fixture
+def handlers(fake, db):
+    io = SyncIO(OutboundDispatcher(global_rate=1000, chat_rate=1000, chat_burst=1000))
+    return Handlers(telebot.TeleBot("123456:test", threaded=False), io, db, db, MemoryStore())
+
+
+def message(update_id, chat_id, text=None, document=None):
+    return telebot.types.Message.de_json(message_update(update_id, chat_id, chat_id, text, document)["message"])
+
+
+def test_verification_delivers_the_file_the_user_asked_for(handlers, fake, db):
+    file_token = run_sync(handlers.save_file_storage(("file-1", "document")))
+    run_sync(handlers.handle_start(message(1, 500, f"/start {file_token}")))
+    handlers.subscription_writes.flush()
+    user = db["users"].find_one({"chat_id": 500})
+    assert user["pending_file"]["token"] == file_token
+
+    # The completion page posts without any query string.
+    assert run_sync(handlers.verify_success(user["unique_id"], "127.0.0.1", {}))[0] == 200
+    handlers.io.delivery_pool.shutdown(wait=True)
+    assert fake.calls["sendDocument"] == 1
+    assert db["users"].find_one({"chat_id": 500}, {"_id": 0, "verified": 1, "pending_file": 1}) == {"verified": True}
+    assert run_sync(handlers.verify_success(user["unique_id"], "127.0.0.1", {}))[0] == 400
+
+
+def test_unknown_link_is_answered_without_a_subscription(handlers, fake, db):
+    run_sync(handlers.handle_start(message(1, 500, "/start nope")))
+    handlers.subscription_writes.flush()
+    assert fake.calls["sendMessage"] == 1
+    assert db["users"].count_documents({}) == 0
+
+
+def test_random_tokens_are_capped_per_route(handlers, db):
+    handlers.route_limiter.limit = 3
+    answers = [run_sync(handlers.verify_success(f"random-{i}", "127.0.0.1", {}))[0] for i in range(5)]
+    assert answers == [400, 400, 400, 429, 429]
+    assert run_sync(handlers.verify_final("random-5", "127.0.0.1", {}))[0] != 429
@@ -0,0 +1,56 @@
+import threading
+
+from telebot import types
+
+from conftest import wait_for
+from ingest import UpdateIngestor
+from store import MemoryStore
+
+
+def update(update_id, chat_id):
+    return types.Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "u"}, "text": str(update_id)}})
+
+
+def test_updates_of_one_chat_keep_their_order():
+    handled = {}
+    lock = threading.Lock()
+
+    def handle(u):
+        with lock:
+            handled.setdefault(u.message.chat.id, []).append(u.update_id)
+
+    ingestor = UpdateIngestor(handle, workers=4)
+    for update_id in range(200):
+        assert ingestor.submit(update(update_id, update_id % 5))
+    wait_for(lambda: ingestor.stats()["processed"] == 200)
+    for chat_id, update_ids in handled.items():
+        assert update_ids == sorted(update_ids)
+
+
+def test_redeliveries_are_dropped_across_workers():
+    store = MemoryStore()
+    handled = []
+    first = UpdateIngestor(handled.append, workers=1, store=store)
+    second = UpdateIngestor(handled.append, workers=1, store=store)
+    assert first.submit(update(1, 5))
+    assert first.submit(update(1, 5))
+    assert second.submit(update(1, 5))
+    wait_for(lambda: first.stats()["processed"] == 1)
+    assert [u.update_id for u in handled] == [1]
+    assert first.stats()["duplicates"] == 1
+    assert second.stats()["duplicates"] == 1
+
+
+def test_full_queue_rejects_and_forgets_the_update():
+    release = threading.Event()
+    store = MemoryStore()
+    ingestor = UpdateIngestor(lambda u: release.wait(), workers=1, max_queue=1, put_timeout=0, store=store)
+    assert ingestor.submit(update(1, 5))
+    wait_for(lambda: ingestor.depth() == 0)
+    assert ingestor.submit(update(2, 5))
+    assert not ingestor.submit(update(3, 5))
+    # Telegram retries a rejected update, which must then be accepted.
+    assert store.add_if_absent("update:3", 60)
+    release.set()
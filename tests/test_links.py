@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+from telebot import types
+
+import core
+from batching import store_batches
+from ids import allocate_link_ids, new_link_id
+from lifecycle import LinkSweeper, TokenSweeper
+
+
+def test_link_options_from_caption():
+    now = datetime(2024, 1, 1)
+    assert core.link_options("expire=2h uses=5", now=now) == {"expires_at": now + timedelta(hours=2),
+                                                              "max_uses": 5, "uses": 0}
+    assert core.link_options(None) == {}
+
+
+def test_use_link_stops_at_max_uses(db):
+    db["file_storage"].insert_one({"unique_id": "a", "max_uses": 2, "uses": 0})
+    db["file_storage"].insert_one({"unique_id": "old", "expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    assert [db["file_storage"].find_one_and_update(*core.use_link("a")) is not None for _ in range(3)] == [True, True, False]
+    assert db["file_storage"].find_one_and_update(*core.use_link("old")) is None
+    assert sorted(doc["unique_id"] for doc in db["file_storage"].find(core.expired_links())) == ["a", "old"]
+
+
+def test_link_ids_are_unique_and_sort_by_time():
+    assert len(new_link_id()) == 13
+    assert new_link_id(now=1000) < new_link_id(now=1001)
+    assert len(set(allocate_link_ids(100))) == 100
+
+
+def album_part(message_id, file_id, media_group_id="g1"):
+    return types.Message.de_json({"message_id": message_id, "date": 0, "media_group_id": media_group_id,
+                                  "chat": {"id": -100200, "type": "supergroup"},
+                                  "from": {"id": 2, "is_bot": False, "first_name": "admin"},
+                                  "document": {"file_id": file_id, "file_unique_id": file_id}})
+
+
+def test_album_parts_flushed_separately_merge_into_one_link(db):
+    db["file_storage"].create_index("media_group_id", unique=True, sparse=True)
+    first = store_batches(db["file_storage"], [[album_part(1, "f1"), album_part(2, "f2")]])
+    second = store_batches(db["file_storage"], [[album_part(3, "f3", media_group_id=None)], [album_part(4, "f4")]])
+    assert first[0] and second[0] and second[1] is None
+    album = db["file_storage"].find_one({"unique_id": first[0]})
+    assert [file_id for file_id, _ in album["file_id"]] == ["f1", "f2", "f4"]
+    assert db["file_storage"].count_documents({}) == 2
+
+
+def test_link_sweeper_counts_active_and_expired(db):
+    links = db["file_storage"]
+    now = datetime.utcnow()
+    links.insert_many([{"_id": "live", "expires_at": now + timedelta(days=1)},
+                       {"_id": "old", "expires_at": now - timedelta(days=1)},
+                       {"_id": "used", "uses": 3, "max_uses": 3},
+                       {"_id": "plain"}])
+    sweeper = LinkSweeper(links, db["file_archive"])
+    sweeper.count()
+    assert (sweeper.active, sweeper.expired) == (2, 2)
+    assert sweeper.sweep() == 2
+    sweeper.count()
+    assert sweeper.stats()["active"] == 2 and sweeper.stats()["expired"] == 0
+
+
+def test_token_sweeper_keeps_the_users(db):
+    users = db["users"]
+    now = datetime.utcnow()
+    users.insert_many([{"chat_id": 1, "unique_id": "old", "token_expires_at": now - timedelta(seconds=1)},
+                       {"chat_id": 2, "unique_id": "new", "token_expires_at": now + timedelta(hours=1)}])
+    sweeper = TokenSweeper(users)
+    assert sweeper.sweep() == 1
+    sweeper.count()
+    assert sweeper.stats()["pending"] == 1 and users.count_documents({}) == 2
+    assert "unique_id" not in users.find_one({"chat_id": 1})
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from outbound import BACKGROUND, USER, OutboundDispatcher, SharedBudget, TokenBucket
+from store import MemoryStore
+
+
+class Flood(Exception):
+    error_code = 429
+    result_json = {"parameters": {"retry_after": 0}}
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = bucket.updated
+    for _ in range(2):
+        assert bucket.wait_time(now) == 0
+        bucket.take()
+    assert bucket.wait_time(now) == pytest.approx(0.1)
+    assert bucket.wait_time(now + 0.11) == 0
+
+
+def test_429_is_retried_and_other_errors_are_raised():
+    outbound = OutboundDispatcher(global_rate=1000, chat_rate=1000, chat_burst=1000)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Flood()
+        return "ok"
+
+    assert outbound.call(5, flaky) == "ok"
+    assert outbound.stats()["retries_429"] == 2
+
+    def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        outbound.call(5, broken)
+    assert outbound.stats()["failures"] == 1
+
+
+def test_shared_budget_keeps_room_for_users():
+    budget = SharedBudget(MemoryStore(), rate=10, background_share=0.8)
+    while time.time() % 1 > 0.5:
+        time.sleep(0.05)
+    background = [budget.wait_time(BACKGROUND) == 0 for _ in range(10)]
+    assert background == [True] * 8 + [False] * 2
+    assert [budget.wait_time(USER) == 0 for _ in range(3)] == [True, True, False]
+
+
+def test_shared_budget_fails_open():
+    class Down:
+        def incr(self, key, ttl, amount=1):
+            raise ConnectionError("store down")
+
+    budget = SharedBudget(Down(), rate=1)
+    assert budget.wait_time(BACKGROUND) == 0
+    assert budget.stats()["errors"] == 1
@@ -0,0 +1,26 @@
+from ratelimit import SlidingWindowLimiter, client_ip
+from store import MemoryStore
+
+
+def test_limit_per_key():
+    limiter = SlidingWindowLimiter("chat", 3, 60)
+    assert [limiter.allow(1) for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow(2)
+    assert limiter.stats()["shed"] == 1
+
+
+def test_shared_store_counts_hits_of_every_worker():
+    store = MemoryStore()
+    workers = [SlidingWindowLimiter("ip", 3, 60, store=store) for _ in range(2)]
+    assert [workers[i % 2].allow("1.2.3.4") for i in range(4)] == [True, True, True, False]
+
+
+def test_client_ip_only_trusts_configured_proxy_hops():
+    assert client_ip("10.0.0.1", "6.6.6.6, 1.2.3.4", trusted_hops=0) == "10.0.0.1"
+    assert client_ip("10.0.0.1", "6.6.6.6, 1.2.3.4", trusted_hops=1) == "1.2.3.4"
+    assert client_ip(None, None) == "unknown"
+
+
+def test_zero_limit_is_disabled():
+    limiter = SlidingWindowLimiter("ip", 0, 60, store=MemoryStore())
+    assert all(limiter.allow("10.0.0.1") for _ in range(100))
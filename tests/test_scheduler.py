@@ -0,0 +1,37 @@
+import threading
+import time
+
+from conftest import wait_for
+from scheduler import DeletionScheduler
+
+
+def test_shared_collection_deletes_each_message_once(db):
+    deleted = []
+    lock = threading.Lock()
+
+    def delete(chat_id, message_id):
+        with lock:
+            deleted.append((chat_id, message_id))
+
+    first = DeletionScheduler(delete, db["scheduled_deletions"])
+    for message_id in range(20):
+        first.schedule(7, message_id, delay=0.2)
+    # The second worker restores the same unclaimed jobs at startup.
+    second = DeletionScheduler(delete, db["scheduled_deletions"])
+    second.instance_id = "other:1"
+    first.start()
+    second.start()
+    wait_for(lambda: db["scheduled_deletions"].count_documents({}) == 0)
+    assert sorted(deleted) == [(7, message_id) for message_id in range(20)]
+
+
+def test_overdue_jobs_of_a_dead_worker_are_adopted(db):
+    deleted = []
+    scheduler = DeletionScheduler(lambda chat_id, message_id: deleted.append(message_id), db["scheduled_deletions"],
+                                  adopt_after=0.1)
+    scheduler.start()
+    # Written after startup, as by another worker that then died; only adoption can pick it up.
+    db["scheduled_deletions"].insert_one({"_id": "7:1", "chat_id": 7, "message_id": 1,
+                                          "run_at": time.time() - 10, "claimed_by": None})
+    wait_for(lambda: deleted == [1])
+    assert scheduler.stats()["deleted"] == 1
@@ -0,0 +1,10 @@
+from conftest import wait_for
+from startup import Startup
+
+
+def test_phases_that_return_false_are_failed():
+    startup = Startup()
+    assert startup.start({"webhook": lambda: False, "indexes": lambda: True, "mongo": lambda: None})
+    wait_for(lambda: startup.stats()["ready"])
+    assert {name: phase["state"] for name, phase in startup.stats()["phases"].items()} == \
+        {"webhook": "failed", "indexes": "done", "mongo": "done"}
@@ -0,0 +1,68 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from transport import TelegramTransport
+
+
+class Status(ThreadingHTTPServer):
+    """Answers every request with ``status`` and counts them."""
+
+    daemon_threads = True
+
+    def __init__(self, status):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.status = status
+        self.hits = 0
+
+    def url(self, method):
+        return f"http://127.0.0.1:{self.server_address[1]}/bot123:x/{method}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.hits += 1
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(request):
+    server = Status(request.param)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.mark.parametrize("server, method, hits", [(502, "sendMessage", 1), (502, "getChatMember", 3),
+                                                  (503, "sendMessage", 3)], indirect=["server"])
+def test_sends_are_only_retried_when_they_cannot_have_been_delivered(server, method, hits):
+    transport = TelegramTransport(retries=2, backoff=0)
+    assert transport.request("post", server.url(method)).status_code == server.status
+    assert server.hits == hits
+
+
+def test_refused_connections_are_retried_for_every_method():
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]
+    transport = TelegramTransport(retries=2, backoff=0)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.request("post", f"http://127.0.0.1:{port}/bot123:x/sendMessage")
+    assert transport.stats()["retried"] == 2
+
+
+def test_configured_read_timeout_replaces_telebots():
+    transport = TelegramTransport(connect_timeout=1, read_timeout=2)
+    sent = []
+    transport.session.request = lambda method, url, timeout, **kwargs: sent.append(timeout) or requests.Response()
+    transport.request("post", "http://127.0.0.1/bot123:x/sendMessage", timeout=(15, 30))
+    transport.request("get", "http://127.0.0.1/bot123:x/getUpdates", params={"timeout": 20}, timeout=(15, 30))
+    assert sent == [(1, 2), (1, 25)]
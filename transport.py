@@ -0,0 +1,100 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+# Telegram's front end answers 503 without passing the request on.
+RETRY_STATUSES = {503}
+# A 502/504 or a dropped connection may come after Telegram acted; only these methods are safe to repeat.
+IDEMPOTENT_METHODS = {"getMe", "getChat", "getChatMember", "getFile", "getUpdates", "getWebhookInfo",
+                      "setWebhook", "deleteWebhook"}
+IDEMPOTENT_RETRY_STATUSES = {502, 503, 504}
+
+
+def never_sent(error):
+    """True when a request failed before any of it could reach Telegram (no connection was made)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0] if error.args else None, "reason", None)
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class TelegramTransport:
+    """Shared, pooled keep-alive HTTP session for every Bot API call.
+
+    Failures are retried with exponential backoff and full jitter only when
+    repeating the call cannot duplicate its effect: the connection was never
+    made, Telegram answered 503, or the method is idempotent (then also 502,
+    504 and dropped connections). A sendMessage whose connection reset after
+    sending is not retried. 429s are left to the outbound dispatcher.
+
+    Only the synchronous TeleBot (main.py) uses it; telebot's asyncio helper
+    has no hook for a custom sender, so async_main.py talks to Telegram
+    through its own aiohttp session without these retries or pool metrics.
+    """
+
+    def __init__(self, pool_size=32, connect_timeout=5, read_timeout=30, retries=2, backoff=0.2):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.errors = 0
+
+    def request(self, method, url, timeout=None, **kwargs):
+        # telebot always passes its own (15, 30) timeout, which is replaced by the configured one.
+        api_method = url.split("?", 1)[0].rsplit("/", 1)[-1]
+        read_timeout = self.read_timeout
+        if api_method == "getUpdates":
+            # Long polling holds the request open for the "timeout" it asks Telegram for.
+            polled = (kwargs.get("params") or {}).get("timeout") or 0
+            read_timeout = max(read_timeout, int(polled) + 5)
+        timeout = (self.connect_timeout, read_timeout)
+        idempotent = api_method in IDEMPOTENT_METHODS
+        retry_statuses = IDEMPOTENT_RETRY_STATUSES if idempotent else RETRY_STATUSES
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+                if response.status_code not in retry_statuses or attempt == self.retries:
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                if attempt == self.retries or not (idempotent or never_sent(e)):
+                    with self._lock:
+                        self.errors += 1
+                    raise
+                logging.warning(f"Telegram connection failed (attempt {attempt + 1}): {e}")
+            with self._lock:
+                self.retried += 1
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def stats(self):
+        connections = 0
+        pool_requests = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+        return {"requests": self.requests, "retried": self.retried, "errors": self.errors,
+                "connections_opened": connections,
+                "connection_reuse_ratio": 1 - connections / pool_requests if pool_requests else 0.0}
+
+
+def install(transport, api_url):
+    """Route all synchronous telebot calls through ``transport`` and ``api_url`` (e.g. a local fake)."""
+    from telebot import apihelper
+    apihelper.API_URL = api_url
+    apihelper.CUSTOM_REQUEST_SENDER = transport.request
@@ -0,0 +1,44 @@
+import time, logging
+import requests
+from config import BOT_TOKEN, WEBHOOK_URL, TELEGRAM_API_URL
+
+def set_webhook(max_retries=3, transport=None):
+    webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{BOT_TOKEN}"
+    url = TELEGRAM_API_URL.format(BOT_TOKEN, "setWebhook")
+    send = transport.request if transport else requests.request
+    for attempt in range(max_retries):
+        try:
+            response = send("get", url, params={"url": webhook_url})
+            response_json = response.json()
+            logging.info(f"Set Webhook Response (Attempt {attempt + 1}): {response_json}")
+            if response_json.get("ok"):
+                logging.info("Webhook set successfully.")
+                return True
+            elif response_json.get("error_code") == 429:
+                retry_after = response_json.get('parameters', {}).get('retry_after', 1)
+                logging.info(f"Too many requests. Retrying after {retry_after} seconds...")
+                time.sleep(retry_after)
+            else:
+                logging.error(f"Error setting webhook: {response_json.get('description')}")
+                return False
+        except Exception as e:
+            logging.error(f"Error while setting webhook: {e}")
+            return False
+    logging.error("Max retries reached. Failed to set webhook.")
+    return False
+
+WEBHOOK_CLAIM = f"setup:webhook:{WEBHOOK_URL}"
+
+def set_webhook_once(store, ttl=300, transport=None):
+    # Several hosts may start together; only the first one to claim the lock calls setWebhook.
+    if not store.add_if_absent(WEBHOOK_CLAIM, ttl):
+        logging.info("Webhook already registered by another instance.")
+        return True
+    done = False
+    try:
+        done = set_webhook(transport=transport)
+        return done
+    finally:
+        if not done:
+            # Release the claim so the next instance to start tries again.
+            store.discard(WEBHOOK_CLAIM)
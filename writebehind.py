@@ -0,0 +1,128 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+
+class WriteBehind:
+    """Buffers write operations for one collection and applies them with ``bulk_write``.
+
+    A batch is flushed ``interval`` seconds after its first write or as soon
+    as it reaches ``batch_size``. Writes added with a ``key`` replace any
+    pending write with the same key, so a burst of upserts for one document
+    costs a single operation. When the buffer is disabled (``interval`` 0) or
+    holds ``max_pending`` writes, ``add`` returns False and the caller should
+    write synchronously; ``write`` does that fallback itself.
+    """
+
+    def __init__(self, collection, name, interval=0.5, batch_size=500, max_pending=10000):
+        self.collection = collection
+        self.name = name
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = {}
+        self._deadline = None
+        self._cond = threading.Condition()
+        # Held while a batch is written, so flush() returns only once earlier writes are applied.
+        self._flushing = threading.Lock()
+        self._sequence = 0
+        self.buffered = 0
+        self.coalesced = 0
+        self.sync_writes = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+        if interval > 0:
+            threading.Thread(target=self._run, name=f"write-behind-{name}", daemon=True).start()
+            atexit.register(self.flush)
+
+    def add(self, operation, key=None):
+        if self.interval <= 0:
+            return False
+        with self._cond:
+            if key is None:
+                self._sequence += 1
+                key = ("seq", self._sequence)
+            elif key in self._pending:
+                self.coalesced += 1
+            elif len(self._pending) >= self.max_pending:
+                return False
+            self._pending[key] = operation
+            self.buffered += 1
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self.interval
+            if len(self._pending) >= self.batch_size:
+                self._deadline = 0.0
+            self._cond.notify()
+        return True
+
+    def write(self, operation, key=None):
+        """Buffer ``operation``, or apply it right away when it cannot be buffered."""
+        if self.add(operation, key):
+            return
+        self.sync_writes += 1
+        self.collection.bulk_write([operation])
+
+    def _take(self):
+        with self._cond:
+            operations = list(self._pending.values())
+            self._pending = {}
+            self._deadline = None
+        return operations
+
+    def flush(self):
+        with self._flushing:
+            self._flush(self._take())
+
+    def _flush(self, operations):
+        for start in range(0, len(operations), self.batch_size):
+            batch = operations[start:start + self.batch_size]
+            try:
+                self.collection.bulk_write(batch, ordered=False)
+                self.flushed += len(batch)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                self.failed += len(errors)
+                self.flushed += len(batch) - len(errors)
+                logging.error(f"{len(errors)} buffered writes to {self.name} failed: {errors[0].get('errmsg') if errors else e}")
+            except Exception as e:
+                self.failed += len(batch)
+                logging.error(f"Failed to flush {len(batch)} buffered writes to {self.name}: {e}")
+            self.flushes += 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._deadline is None or self._deadline > time.monotonic():
+                    self._cond.wait(None if self._deadline is None else self._deadline - time.monotonic())
+            self.flush()
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {"pending": pending, "buffered": self.buffered, "coalesced": self.coalesced,
+                "sync_writes": self.sync_writes, "flushes": self.flushes, "flushed": self.flushed, "failed": self.failed}
+
+
+class EventLog:
+    """Append-only log of bot events (starts, verifications, file deliveries) written through a ``WriteBehind``."""
+
+    def __init__(self, writes, enabled=True):
+        self.writes = writes
+        self.enabled = enabled
+        self.dropped = 0
+
+    def record(self, event, chat_id, **fields):
+        if not self.enabled:
+            return
+        # Analytics can lose an event under overload; a request never waits on this write.
+        if not self.writes.add(InsertOne({"event": event, "chat_id": chat_id, "at": datetime.utcnow(), **fields})):
+            self.dropped += 1
+
+    def stats(self):
+        return {"enabled": self.enabled, "dropped": self.dropped, **self.writes.stats()}